@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+import io
+import tarfile
+import zipfile
+import logging
+
+from pathlib import Path, PurePosixPath
+from functools import partial
+from stats import stats
+from mapped import BufferFile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import libarchive
+except ImportError:
+    libarchive = None
+
+logger = logging.getLogger(__name__)
+
+# 按后缀识别压缩包格式，长的后缀在前
+FORMATS = (
+    (".tar.gz", "tar"), (".tgz", "tar"), (".tar.bz2", "tar"), (".tar.xz", "tar"), (".tar", "tar"),
+    (".tar.zst", "tar.zst"), (".tzst", "tar.zst"), (".zip", "zip"), (".7z", "7z"),
+)
+
+
+def archive_format(name):
+    '''返回文件名对应的压缩包格式，不是压缩包或所需的库未安装时返回None'''
+    name = name.lower()
+    for suffix, fmt in FORMATS:
+        if name.endswith(suffix):
+            if fmt == "tar.zst" and zstandard is None: return None
+            if fmt == "7z" and libarchive is None: return None
+            return fmt
+    return None
+
+
+def archive_stem(name):
+    '''去掉压缩包后缀的文件名，只去掉FORMATS中匹配的后缀：mylib-1.2.3.tar.gz -> mylib-1.2.3'''
+    lower = name.lower()
+    for suffix, _ in FORMATS:
+        if lower.endswith(suffix): return name[:-len(suffix)]
+    return name
+
+
+class ArchiveMember:
+    '''压缩包中的一个文件，filename/file_size和zipfile.ZipInfo一致，open()返回只读的文件对象'''
+    def __init__(self, filename, file_size, opener):
+        self.filename = filename
+        self.file_size = file_size
+        self._opener = opener
+
+    def open(self):
+        return self._opener()
+
+
+class Members:
+    '''CodeFileInstance通过 zf.open(成员) 读取压缩包中的文件，ArchiveMember自带打开方式，所有压缩包共用这一个对象'''
+    @staticmethod
+    def open(member: ArchiveMember):
+        return member.open()
+
+
+MEMBERS = Members()
+
+
+class BlockReader(io.RawIOBase):
+    '''把libarchive按块产生的内容包装成文件对象'''
+    def __init__(self, blocks):
+        super(BlockReader, self).__init__()
+        self._blocks = iter(blocks)
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            self._buffer = next(self._blocks, None)
+            if self._buffer is None:
+                self._buffer = b""
+                return 0
+            self._buffer = bytes(self._buffer)
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+def _is_path(source):
+    return isinstance(source, (str, Path))
+
+
+def _read_zip(source):
+    with zipfile.ZipFile(source if _is_path(source) else BufferFile(source), "r") as zf:
+        for info in zf.infolist():
+            if info.is_dir(): continue
+            yield ArchiveMember(info.filename, info.file_size, partial(zf.open, info))
+
+
+def _read_tar_stream(tf):
+    for info in tf:
+        if not info.isfile(): continue
+        yield ArchiveMember(info.name, info.size, partial(tf.extractfile, info))
+
+
+def _read_tar(source):
+    # 流式模式（r|*）自动识别gzip/bz2/xz，不需要随机访问，也就不需要解压到磁盘或整个读进内存
+    if _is_path(source):
+        with tarfile.open(source, mode="r|*") as tf:
+            yield from _read_tar_stream(tf)
+    else:
+        with tarfile.open(fileobj=BufferFile(source), mode="r|*") as tf:
+            yield from _read_tar_stream(tf)
+
+
+def _read_tar_zst(source):
+    with (open(source, "rb") if _is_path(source) else BufferFile(source)) as raw:
+        with zstandard.ZstdDecompressor().stream_reader(raw) as reader:
+            with tarfile.open(fileobj=reader, mode="r|") as tf:
+                yield from _read_tar_stream(tf)
+
+
+def _read_libarchive(source):
+    reader = libarchive.file_reader(str(source)) if _is_path(source) else libarchive.memory_reader(bytes(source))
+    with reader as archive:
+        for entry in archive:
+            if not entry.isfile: continue
+            yield ArchiveMember(entry.pathname, entry.size, partial(BlockReader, entry.get_blocks()))
+
+
+READERS = {"zip": _read_zip, "tar": _read_tar, "tar.zst": _read_tar_zst, "7z": _read_libarchive}
+
+
+def nested_format(filename, size, nested_depth, max_nested_size):
+    '''filename是需要展开的嵌套压缩包时返回它的格式，否则返回None'''
+    if nested_depth <= 0 or size > max_nested_size: return None
+    return archive_format(filename)
+
+
+def iter_nested(source, fmt, filename, nested_depth, max_nested_size):
+    '''展开仓库中的压缩包，成员名为 压缩包路径/成员路径。损坏的压缩包只记录警告，不影响仓库中的其他文件'''
+    stats.count("archives.nested")
+    try:
+        yield from iter_members(source, fmt, filename + "/", nested_depth - 1, max_nested_size)
+    except Exception as err:
+        stats.count("archives.nested_error")
+        logger.warning(f"{filename} 展开失败: {err}")
+
+
+def iter_members(source, fmt, prefix="", nested_depth=0, max_nested_size=256 * 1024 * 1024):
+    '''逐个yield压缩包中的普通文件（ArchiveMember），source为磁盘上的路径或内存中的内容（bytes/mmap/memoryview）。
+    tar类压缩包是流式读取的，只能按顺序访问，必须在取下一个成员之前读完当前成员。
+    nested_depth大于0时，把不超过max_nested_size的嵌套压缩包读进内存后递归展开，嵌套压缩包本身不再作为文件返回。'''
+    for member in READERS[fmt](source):
+        member.filename = prefix + member.filename
+        inner = nested_format(member.filename, member.file_size, nested_depth, max_nested_size)
+        if inner is None:
+            yield member
+            continue
+        with member.open() as fp:
+            data = fp.read()
+        yield from iter_nested(data, inner, member.filename, nested_depth, max_nested_size)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+import os
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class AuthorIndex:
+    '''T文件中 仓库id -> 作者 的映射，第一次使用时建成SQLite索引，之后按id查找，不需要把整个T文件读进内存。
+    T文件每行为 "id, https://github.com/作者/仓库"，同一个id出现多次时以最后一次为准。
+    索引中记录了T文件的大小和mtime，T文件变化后重新建立；index_path默认为T文件旁边的 <T文件>.index.sqlite。'''
+    def __init__(self, tfile_path, index_path=None, batch_size=100000):
+        self.tfile_path = str(tfile_path)
+        self.index_path = str(index_path) if index_path is not None else self.tfile_path + ".index.sqlite"
+        self.batch_size = batch_size
+        st = os.stat(self.tfile_path)
+        self._version = f"{st.st_size}:{st.st_mtime_ns}"
+        if not self._is_fresh(): self._build()
+        self._conn = sqlite3.connect(f"file:{self.index_path}?mode=ro", uri=True, check_same_thread=False)
+
+    def _is_fresh(self):
+        if not os.path.exists(self.index_path): return False
+        try:
+            with sqlite3.connect(f"file:{self.index_path}?mode=ro", uri=True) as conn:
+                row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        except sqlite3.Error:
+            return False
+        return row is not None and row[0] == self._version
+
+    @staticmethod
+    def _parse(lines):
+        for line in lines:
+            try:
+                k, v = line.split(", ")
+                yield k, v.split("/")[3]
+            except (ValueError, IndexError):
+                continue
+
+    def _build(self):
+        '''先建到临时文件，完成后再替换，避免中断或多个进程同时建立时留下不完整的索引'''
+        logger.info(f"建立T文件索引 {self.index_path}")
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("PRAGMA cache_size=-262144")
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("CREATE TABLE authors (id TEXT PRIMARY KEY, author TEXT) WITHOUT ROWID")
+        # 先按行顺序追加到临时表，再排好序一次性插入，比按随机顺序插入B树快得多；rowid大的后插入，覆盖同id的前面的行
+        conn.execute("CREATE TEMP TABLE lines (id TEXT, author TEXT)")
+        with open(self.tfile_path, "r", encoding="utf-8") as r:
+            batch = list()
+            for item in self._parse(r):
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    conn.executemany("INSERT INTO lines VALUES (?, ?)", batch)
+                    batch = list()
+            conn.executemany("INSERT INTO lines VALUES (?, ?)", batch)
+        conn.execute("INSERT OR REPLACE INTO authors SELECT id, author FROM lines ORDER BY id, rowid")
+        conn.execute("DROP TABLE lines")
+        conn.execute("INSERT INTO meta VALUES ('version', ?)", (self._version,))
+        conn.commit()
+        conn.close()
+        os.replace(tmp_path, self.index_path)
+
+    def get(self, rid, default=None):
+        row = self._conn.execute("SELECT author FROM authors WHERE id = ?", (rid,)).fetchone()
+        return default if row is None else row[0]
+
+    def __contains__(self, rid):
+        return self.get(rid) is not None
+
+    def __getitem__(self, rid):
+        author = self.get(rid)
+        if author is None: raise KeyError(rid)
+        return author
+
+    def close(self):
+        self._conn.close()
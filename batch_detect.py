@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+import time
+
+from charset_mnbvc import api
+from stats import stats
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 快速判断不了、需要交给charset_mnbvc的内容
+UNDECIDED = object()
+
+_BOM = b"\xef\xbb\xbf"
+
+
+def _finish_fast(data, ascii_only, escaped):
+    '''ASCII和合法UTF-8的内容不需要完整的检测，结果与 api.from_data(data, mode=2) 相同：
+    空内容为None；含有"ufffd"（包括U+FFFD本身，检测前会先做unicode_escape）时为"UNKNOWN"，否则为"utf_8"。
+    带ESC或"~{"的内容可能是ISO-2022/HZ这类7位编码，带BOM的为"utf_8_sig"，都交给完整的检测。'''
+    if not data: return None
+    if escaped or data.startswith(_BOM): return UNDECIDED
+    if ascii_only: return "UNKNOWN" if b"ufffd" in data else "utf_8"
+    try:
+        text = data.decode("utf-8")
+    except UnicodeDecodeError:
+        return UNDECIDED
+    return "UNKNOWN" if "�" in text or "ufffd" in text else "utf_8"
+
+
+def fast_detect(buffers):
+    '''逐个返回buffers的编码，快速判断不了的为UNDECIDED。
+    安装了NumPy且不止一个内容时，把它们拼在一起一次性判断是否为纯ASCII、是否含有ESC和"~{"，否则逐个判断，两种方式结果相同。'''
+    if np is None or len(buffers) < 2:
+        return [_finish_fast(data, data.isascii(), b"\x1b" in data or b"~{" in data) for data in buffers]
+    lengths = np.fromiter((len(data) for data in buffers), dtype=np.int64, count=len(buffers))
+    nonempty = lengths > 0
+    if not nonempty.any(): return [None] * len(buffers)
+    arr = np.frombuffer(b"".join(buffers), dtype=np.uint8)
+    ends = np.cumsum(lengths)
+    # reduceat不能处理空的区间，只对非空的内容计算
+    starts = (ends - lengths)[nonempty]
+    ascii_only = np.zeros(len(buffers), dtype=bool)
+    escaped = np.zeros(len(buffers), dtype=bool)
+    ascii_only[nonempty] = np.maximum.reduceat(arr, starts) < 0x80
+    # "~{"不能跨越两个内容的边界
+    tilde_brace = np.zeros(len(arr), dtype=bool)
+    tilde_brace[:-1] = (arr[:-1] == 0x7e) & (arr[1:] == 0x7b)
+    tilde_brace[ends[nonempty] - 1] = False
+    escaped[nonempty] = np.logical_or.reduceat((arr == 0x1b) | tilde_brace, starts)
+    return [_finish_fast(data, bool(a), bool(e)) for data, a, e in zip(buffers, ascii_only, escaped)]
+
+
+class BatchDetector:
+    '''一批文件一起检测编码：先用fast_detect判断ASCII和合法UTF-8的内容，
+    剩下的再逐个交给charset_mnbvc（detect_cache不为None时经过缓存），每个文件的结果与单独检测时相同。
+    快速判断和完整检测的文件数分别计数到 detect.fast/detect.full。'''
+    def __init__(self, detect_cache=None):
+        self.detect_cache = detect_cache
+
+    def detect(self, items):
+        '''items为 [(内容, md5)]，返回对应的编码列表'''
+        t = time.perf_counter()
+        results = fast_detect([data for data, _ in items])
+        n_full = 0
+        for i, (data, md5) in enumerate(items):
+            if results[i] is not UNDECIDED: continue
+            n_full += 1
+            results[i] = api.from_data(data, mode=2) if self.detect_cache is None else self.detect_cache.detect(data, md5)
+        stats.count("detect.fast", len(items) - n_full)
+        stats.count("detect.full", n_full)
+        stats.lap("detect", t)
+        return results
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+'''转换流程的基准测试：生成可复现的合成仓库zip，分别用各个converter处理，
+输出 files/s、MB/s、峰值内存以及 read/hash/detect/decode/serialize/write 各阶段的耗时。
+不需要联网，可以在部署前用来发现吞吐量的退化。
+
+    python bench.py --scale 1 --json bench.json
+'''
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import zipfile
+import argparse
+import tempfile
+import resource
+import multiprocessing
+
+from pathlib import Path
+
+STAGES = ("unzip", "read", "hash", "detect", "decode", "serialize", "write")
+CONVERTERS = ("converter", "converter_memory", "github", "github_memory", "arxiv", "google")
+
+
+def random_code(rnd, n_lines):
+    words = ["def", "return", "if", "else", "for", "while", "int", "value", "self", "print", "x", "y", "=", "+", "(", ")", ":"]
+    return "\n".join(" ".join(rnd.choice(words) for _ in range(rnd.randint(2, 12))) for _ in range(n_lines)) + "\n"
+
+
+def random_chinese(rnd, n_chars):
+    return "".join(chr(rnd.randint(0x4e00, 0x9fa5)) for _ in range(n_chars))
+
+
+def make_repo_files(rnd, scale):
+    '''一个仓库的(路径, 内容)：大量小文件、少量大文件、GBK/UTF-8/二进制混合、深层嵌套目录'''
+    files = list()
+    for i in range(200 * scale):
+        ext = rnd.choice([".py", ".js", ".c", ".go", ".md"])
+        files.append((f"src/pkg{i % 10}/file{i}{ext}", random_code(rnd, rnd.randint(1, 40)).encode("utf-8")))
+    for i in range(2):
+        files.append((f"data/huge{i}.txt", random_code(rnd, 40000 * scale).encode("utf-8")))
+    for i in range(20 * scale):
+        text = "// " + random_chinese(rnd, 200) + "\n" + random_code(rnd, 20)
+        files.append((f"cn/gbk{i}.c", text.encode("gbk")))
+        files.append((f"cn/utf8_{i}.md", text.encode("utf-8")))
+    for i in range(10 * scale):
+        files.append((f"bin/blob{i}.dat", rnd.randbytes(rnd.randint(1024, 64 * 1024))))
+        files.append((f"assets/img{i}.png", b"\x89PNG\r\n\x1a\n" + rnd.randbytes(4096)))
+    deep = "/".join(f"d{i}" for i in range(30))
+    for i in range(5):
+        files.append((f"{deep}/deep{i}.py", random_code(rnd, 10).encode("utf-8")))
+    return files
+
+
+def write_zip(zip_path, repo_name, files):
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in files:
+            zf.writestr(f"{repo_name}/{name}", data)
+
+
+def generate(workdir, scale, n_repos, seed):
+    '''生成合成数据，返回正常仓库和损坏zip中各自的文件数和字节数。corrupt/下的zip结尾带一个假的中央目录结尾记录，
+    对应engine.py中处理 Bad magic number for central directory 的情况'''
+    rnd = random.Random(seed)
+    zips, corrupt, folders = workdir / "zips", workdir / "corrupt", workdir / "folders"
+    for d in (zips, corrupt, folders): d.mkdir(parents=True)
+    n_files, n_bytes = 0, 0
+    for i in range(n_repos):
+        files = make_repo_files(rnd, scale)
+        n_files += len(files)
+        n_bytes += sum(len(data) for _, data in files)
+        write_zip(zips / f"{10000 + i}.zip", f"repo{i}-main", files)
+        with zipfile.ZipFile(zips / f"{10000 + i}.zip") as zf:
+            zf.extractall(folders / f"repo{i}")
+    files = make_repo_files(rnd, scale)
+    write_zip(corrupt / "99999.zip", "broken-main", files)
+    with open(corrupt / "99999.zip", "ab") as a:
+        a.write(b"PK\005\006" + rnd.randbytes(18) + b"trailing garbage")
+    return (n_files, n_bytes), (len(files), sum(len(data) for _, data in files))
+
+
+def run_converter(name, workdir, result_queue):
+    '''在单独的子进程中运行，保证峰值内存互不影响，各阶段耗时和文件数取自converter内置的stats'''
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    import logging
+    logging.disable(logging.INFO)
+    sys.stdout = open(os.devnull, "w")
+    sys.stderr = open(os.devnull, "w")
+    from stats import stats
+    out = workdir / f"out_{name}"
+    start = time.perf_counter()
+    if name in ("converter", "converter_memory"):
+        import converter
+        start = time.perf_counter()
+        converter.process_zips(workdir / "zips", out, False, "github", in_memory=name == "converter_memory")
+    elif name in ("github", "github_memory"):
+        from engine import Converter, GithubZipSource, PROFILES
+        # 合成的zip都算作同一个作者，不需要T文件
+        authors = {f.stem: "bench" for f in (workdir / "zips").glob("*.zip")}
+        authors.update({f.stem: "bench" for f in (workdir / "corrupt").glob("*.zip")})
+        converter = Converter(GithubZipSource(authors, in_memory=name == "github_memory"), PROFILES["github"], out, platform="github")
+        start = time.perf_counter()
+        converter.run(workdir)
+    else:
+        module = __import__(f"converter_{name}")
+        start = time.perf_counter()
+        module.process_zips(str(workdir / "folders"), out, False)
+    elapsed = time.perf_counter() - start
+    out_bytes = sum(p.stat().st_size for p in out.glob("*") if p.is_file())
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    result_queue.put({"name": name, "elapsed": elapsed, "files": stats.counters["files.seen"], "out_bytes": out_bytes,
+                      "peak_rss": peak_rss, "stages": dict(stats.times)})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", type=int, default=1, help="每个仓库的文件数和大文件大小的倍数")
+    parser.add_argument("--repos", type=int, default=8, help="合成仓库的个数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子，相同的种子生成相同的数据")
+    parser.add_argument("--converters", type=str, default=",".join(CONVERTERS), help="要测试的converter，逗号分隔")
+    parser.add_argument("--workdir", type=str, default=None, help="存放合成数据和输出的目录，默认使用临时目录并在结束后删除")
+    parser.add_argument("--json", type=str, default=None, help="把结果保存为json文件")
+    args = parser.parse_args()
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="githubcode_bench_"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    assert not any(workdir.iterdir()), f"{workdir} is not empty."
+    start = time.perf_counter()
+    (n_files, n_bytes), (n_corrupt_files, n_corrupt_bytes) = generate(workdir, args.scale, args.repos, args.seed)
+    print(f"生成 {args.repos} 个仓库，{n_files} 个文件，{n_bytes / 1024 / 1024:.1f} MB，耗时 {time.perf_counter() - start:.1f} 秒")
+
+    ctx = multiprocessing.get_context("spawn")
+    results = list()
+    for name in args.converters.split(","):
+        queue = ctx.Queue()
+        p = ctx.Process(target=run_converter, args=(name, workdir, queue))
+        p.start()
+        result = queue.get()
+        p.join()
+        # 只有converter_github.py会处理损坏的zip
+        input_bytes = n_bytes + (n_corrupt_bytes if name.startswith("github") else 0)
+        result["mb_per_s"] = input_bytes / 1024 / 1024 / result["elapsed"]
+        result["files_per_s"] = result["files"] / result["elapsed"]
+        results.append(result)
+
+    header = f"{'converter':<18}{'files/s':>10}{'MB/s':>8}{'peak MB':>9}" + "".join(f"{s:>10}" for s in STAGES)
+    print(header)
+    for r in results:
+        print(f"{r['name']:<18}{r['files_per_s']:>10.1f}{r['mb_per_s']:>8.2f}{r['peak_rss'] / 1024 / 1024:>9.1f}"
+              + "".join(f"{r['stages'].get(s, 0.0):>10.3f}" for s in STAGES))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as w:
+            json.dump({"scale": args.scale, "repos": args.repos, "seed": args.seed, "input_files": n_files,
+                       "input_bytes": n_bytes, "corrupt_files": n_corrupt_files, "corrupt_bytes": n_corrupt_bytes,
+                       "results": results}, w, ensure_ascii=False, indent=2)
+    if args.workdir is None: shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+import os
+import json
+
+from pathlib import Path
+
+
+class CheckpointManifest:
+    '''断点续跑用的清单。每处理完一个输入追加一行：输入的路径、mtime、大小，以及此时写到的分片序号、字节偏移和压缩前的字节数。
+    每行写完立即fsync，崩溃时最多留下一行不完整的记录，读取时忽略即可。
+    处理失败的输入不记录到清单中，续跑时会重新处理，失败的原因另外记录在 <清单>.failed 中。
+    新的清单第一行记录开始时写入器所在的位置（mark_start），还没有完成任何输入就崩溃时续跑回到这里，不会截掉之前已有的分片。
+    resume为False时清空已有的清单重新开始。'''
+    def __init__(self, manifest_path, resume=False):
+        self.path = Path(manifest_path)
+        self.failed_path = self.path.with_name(self.path.name + ".failed")
+        if not resume: self.failed_path.unlink(missing_ok=True)
+        self.done = dict()   # 路径 -> (mtime, size)
+        self.last = None     # 最后一个完成的输入对应的 (分片序号, 字节偏移[, 压缩前的字节数])
+        self.start = None    # 开始时写入器所在的位置，格式同last
+        if resume and self.path.exists():
+            good = 0
+            with open(self.path, "rb") as r:
+                for line in r:
+                    if not line.endswith(b"\n"): break
+                    try:
+                        item = json.loads(line)
+                    except ValueError:
+                        break
+                    good += len(line)
+                    if item.get("start"):
+                        self.start = self._position(item)
+                        continue
+                    self.done[item["path"]] = (item["mtime"], item["size"])
+                    self.last = self._position(item)
+            os.truncate(self.path, good)  # 去掉崩溃时写了一半的最后一行
+        self._fp = open(self.path, "a" if resume else "w", encoding="utf-8")
+
+    @staticmethod
+    def _position(item):
+        return (item["chunk"], item["offset"]) if item.get("size_out") is None else (item["chunk"], item["offset"], item["size_out"])
+
+    @property
+    def position(self):
+        '''续跑时写入器应该回到的位置：最后一个完成的输入之后，没有完成任何输入时为开始的位置，都没有时为None'''
+        return self.last or self.start
+
+    def _append(self, item):
+        self._fp.write(json.dumps(item, ensure_ascii=False) + "\n")
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+
+    def mark_start(self, chunk_counter, offset, size_out=None):
+        '''在新的清单中记录开始时写入器的位置，参数为写入之前sync()的返回值'''
+        item = {"start": True, "chunk": chunk_counter, "offset": offset}
+        if size_out is not None: item["size_out"] = size_out
+        self._append(item)
+        self.start = self._position(item)
+
+    def is_done(self, file_path):
+        '''输入已经处理过，且之后没有被修改'''
+        key = str(file_path)
+        if key not in self.done: return False
+        st = os.stat(file_path)
+        return self.done[key] == (st.st_mtime_ns, st.st_size)
+
+    def mark_done(self, file_path, stat_result, chunk_counter, offset, size_out=None):
+        '''stat_result需要在处理前取得，clean_src_file时输入处理完就已经删除了。size_out为分片压缩前的字节数'''
+        item = {"path": str(file_path), "mtime": stat_result.st_mtime_ns, "size": stat_result.st_size,
+                "chunk": chunk_counter, "offset": offset}
+        if size_out is not None: item["size_out"] = size_out
+        self._append(item)
+        self.last = self._position(item)
+
+    def mark_failed(self, file_path, error):
+        with open(self.failed_path, "a", encoding="utf-8") as w:
+            w.write(json.dumps({"path": str(file_path), "error": str(error)}, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self._fp.close()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+import os
+import time
+import logging
+
+from pathlib import Path
+from stats import stats
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+STREAM_SUFFIX = ".arrows"
+
+
+def arrow_schema(columns):
+    '''columns为 [(列名, "int"/"str")]'''
+    return pa.schema([(name, pa.int64() if kind == "int" else pa.string()) for name, kind in columns])
+
+
+class ShardedColumnarWriter:
+    '''按大小切分的Parquet/Arrow写入器，接口和ShardedJsonlWriter相同，可以直接替换。
+    记录先按列缓存，每batch_rows条或text超过batch_bytes时作为一个record batch追加到当前分片的Arrow IPC流（<前缀>.<序号>.arrows）中；
+    IPC流可以在任意batch边界截断，断点续跑的sync/resume和jsonl一样按字节偏移进行。
+    分片只在sync()时（即一个仓库写完之后）检查大小，超过max_size后转成最终的 <前缀>.<序号>.parquet 或 .arrow（IPC文件格式），
+    text单独成列，只读元数据列的扫描不需要读text。columns为 [(列名, "int"/"str")]，记录中没有的列为null。
+    输出目录中已经有分片时，从第一个没有用过的序号开始写，不会覆盖已有的分片（断点续跑时由resume()决定）。'''
+    def __init__(self, output_root, prefix, columns, fmt="parquet", max_size=500 * 1024 * 1024, chunk_counter=0,
+                 batch_rows=1024, batch_bytes=64 * 1024 * 1024, compression=None):
+        assert fmt in ("parquet", "arrow"), f"unknown columnar format {fmt}"
+        if not os.path.exists(output_root): os.makedirs(output_root)
+        self.output = Path(output_root)
+        self.prefix = prefix
+        self.columns = [name for name, _ in columns]
+        self.schema = arrow_schema(columns)
+        self.fmt = fmt
+        self.max_size = max_size
+        self.chunk_counter = chunk_counter
+        self.batch_rows = batch_rows
+        self.batch_bytes = batch_bytes
+        if fmt == "arrow" and compression == "gzip":
+            logger.warning("Arrow IPC不支持gzip压缩，改用zstd")
+            compression = "zstd"
+        self.compression = compression
+        self._buffer = {name: list() for name in self.columns}
+        self._rows = 0
+        self._text_bytes = 0
+        self._fp = None
+        self._finalized = list()  # 已经转成最终格式、下一次sync时删除的IPC流
+        used = [idx for suffix in (STREAM_SUFFIX, self.suffix) for idx, _ in self._shards(suffix)]
+        if used: self.chunk_counter = max(self.chunk_counter, max(used) + 1)
+        self._synced = None       # 上次sync()的位置，rollback()时回到这里
+        self._unsynced = 0        # 上次sync()之后写入的记录数
+
+    @property
+    def suffix(self):
+        return ".parquet" if self.fmt == "parquet" else ".arrow"
+
+    def _shards(self, suffix):
+        '''输出目录中已有的 (序号, 路径)'''
+        for p in self.output.glob(f"{self.prefix}.*{suffix}"):
+            idx = p.name[len(self.prefix) + 1:-len(suffix)]
+            if idx.isdigit(): yield int(idx), p
+
+    def get_stream_file(self, chunk_counter=None):
+        return self.output / f"{self.prefix}.{self.chunk_counter if chunk_counter is None else chunk_counter}{STREAM_SUFFIX}"
+
+    def get_shard_file(self, chunk_counter=None):
+        return self.output / f"{self.prefix}.{self.chunk_counter if chunk_counter is None else chunk_counter}{self.suffix}"
+
+    def _open(self):
+        path = self.get_stream_file()
+        self._fp = open(path, "ab")
+        if self._synced is None: self._synced = (self.chunk_counter, self._fp.tell())
+        if self._fp.tell() == 0: self._fp.write(self.schema.serialize())
+
+    def write(self, dic):
+        for name in self.columns:
+            self._buffer[name].append(dic.get(name))
+        self._rows += 1
+        self._text_bytes += len(dic.get("text") or "")
+        stats.count("files.kept")
+        self._unsynced += 1
+        if self._rows >= self.batch_rows or self._text_bytes >= self.batch_bytes: self._flush_batch()
+
+    def _flush_batch(self):
+        if not self._rows: return
+        start = time.perf_counter()
+        batch = pa.record_batch([pa.array(self._buffer[name], type=self.schema.field(name).type) for name in self.columns], schema=self.schema)
+        data = batch.serialize()
+        start = stats.lap("serialize", start)
+        if self._fp is None: self._open()
+        self._fp.write(data)
+        stats.lap("write", start)
+        stats.count("bytes.out", data.size)
+        self._buffer = {name: list() for name in self.columns}
+        self._rows = 0
+        self._text_bytes = 0
+
+    def _finalize(self, chunk_counter):
+        '''把IPC流转成最终的分片，先写到临时文件再改名，IPC流留到下一次sync时再删除'''
+        stream_path = self.get_stream_file(chunk_counter)
+        shard_path = self.get_shard_file(chunk_counter)
+        tmp_path = shard_path.with_name(shard_path.name + ".tmp")
+        with pa.memory_map(str(stream_path)) as source:
+            reader = ipc.open_stream(source)
+            if self.fmt == "parquet":
+                with pq.ParquetWriter(str(tmp_path), self.schema, compression=self.compression or "snappy") as writer:
+                    for batch in reader: writer.write_batch(batch)
+            else:
+                options = ipc.IpcWriteOptions(compression=self.compression)
+                with ipc.new_file(str(tmp_path), self.schema, options=options) as writer:
+                    for batch in reader: writer.write_batch(batch)
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, shard_path)
+        self._finalized.append(stream_path)
+
+    def _close_stream(self):
+        if self._fp is None: return
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        self._fp.close()
+        self._fp = None
+
+    def sync(self):
+        '''同ShardedJsonlWriter.sync，返回(分片序号, 当前IPC流已落盘的字节数)。
+        当前分片超过max_size时在这里转成最终的分片，之后的记录写到下一个分片'''
+        for path in self._finalized: path.unlink(missing_ok=True)
+        self._finalized = list()
+        self._flush_batch()
+        if self._fp is None:
+            path = self.get_stream_file()
+            return self.chunk_counter, path.stat().st_size if path.exists() else 0
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        size = self._fp.tell()
+        if size > self.max_size:
+            self._close_stream()
+            self._finalize(self.chunk_counter)
+            self.chunk_counter += 1
+            size = 0
+        self._synced = (self.chunk_counter, size)
+        self._unsynced = 0
+        return self._synced
+
+    def rollback(self):
+        '''丢弃上次sync()之后写入的内容，用于一个输入处理失败时'''
+        self._buffer = {name: list() for name in self.columns}
+        self._rows = 0
+        self._text_bytes = 0
+        stats.count("files.kept", -self._unsynced)
+        stats.count("files.rolled_back", self._unsynced)
+        self._unsynced = 0
+        if self._synced is None: return  # 还没有写入过
+        self._close_stream()
+        self.resume(*self._synced)
+
+    def resume(self, chunk_counter, offset, size=None):
+        '''断点续跑：回到chunk_counter分片IPC流的offset处继续写，丢弃其后的内容和更后面的分片。
+        IPC流已经不在、最终的分片已经生成时（关闭时崩溃），从下一个分片开始写。size只用于和ShardedJsonlWriter保持一致'''
+        assert self._fp is None, "resume() must be called before writing"
+        self.chunk_counter = chunk_counter
+        for p in self.output.glob(f"{self.prefix}.*{self.suffix}.tmp"): p.unlink()
+        for suffix in (STREAM_SUFFIX, self.suffix):
+            for idx, p in list(self._shards(suffix)):
+                if idx > chunk_counter: p.unlink()
+                # 更早的分片已经转成最终格式，只是IPC流还没来得及删除
+                elif idx < chunk_counter and suffix == STREAM_SUFFIX and self.get_shard_file(idx).exists(): p.unlink()
+        stream_path = self.get_stream_file()
+        if stream_path.exists():
+            # 转换完成但还没有记录到清单，最终的分片作废，以IPC流为准
+            self.get_shard_file().unlink(missing_ok=True)
+            os.truncate(stream_path, offset)
+            if offset == 0: stream_path.unlink()
+        elif self.get_shard_file().exists():
+            self.chunk_counter += 1
+
+    def close(self):
+        self._flush_batch()
+        self._close_stream()
+        # 断点续跑之后没有新的记录时，IPC流中也可能有之前写入的内容
+        if self.get_stream_file().exists():
+            self._finalize(self.chunk_counter)
+            self.chunk_counter += 1
+        for path in self._finalized: path.unlink(missing_ok=True)
+        self._finalized = list()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
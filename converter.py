@@ -1,22 +1,10 @@
 #!/usr/bin/env python
 # -*- coding:utf-8 -*-
-import os
-import sys
-import argparse
-import json
-import shutil
-import logging
-import time
-import zipfile
-import hashlib as hs
-
-from typing import List
-from pathlib import PurePosixPath, Path
-from charset_mnbvc import api
+from engine import Converter, ZipSource, PROFILES
 
 #######################################################
 # 换新的平台的时候先把下面的debug_mode调成True跑一下
-# name_position对应RepoInstance.name的解析索引，将其修改成输出的元祖中仓库名对应的索引即可
+# name_position对应仓库名的解析索引，将其修改成输出的元祖中仓库名对应的索引即可
 # 比如输出为：('zips', 'zipout-10000115', 'list-master', 'list.c'), 其中的 'list-master' 为仓库名
 # 那么将下面的name_position的值设为2即可
 debug_mode = False
@@ -26,203 +14,38 @@ repos_folder = './zips'    # 存放仓库们的目录，目录下可以是zip文
 output_folder = './out'    # jsonl输出的目录
 plateform = 'github'       # 仓库来自哪个平台
 clean_src_file = False     # 是否删除源文件
+in_memory = False          # 是否直接从zip中读取文件，不解压到磁盘
+workers = 1                # 并行处理zip的进程数，1为单进程
+output_format = "jsonl"    # 输出格式，"jsonl"/"parquet"/"arrow"，parquet/arrow需要安装pyarrow，未安装时退回jsonl
+compression = None         # 输出压缩格式，None/"zstd"/"gzip"，zstandard未安装时zstd退回gzip
+split_by_compressed = False  # 是否按压缩后的大小切分jsonl
+max_file_size = None       # 超过该大小（字节）的文件直接跳过，None为不限制
+dedup_db = None            # md5去重索引（SQLite）的路径，可跨多次运行、多个平台共用，None为不去重
+dedup_mode = "drop"        # "drop"丢弃重复文件，"reference"保留第一次出现的文件，重复文件只记录引用
+near_dup_db = None         # MinHash/LSH近似去重索引（SQLite）的路径，跨zip、跨多次运行共用，None为不做近似去重
+near_dup_mode = "flag"     # "drop"丢弃近似重复的文件，"flag"保留并记录相似的文件
+near_dup_threshold = 0.85  # 估计的Jaccard相似度不低于该值时视为近似重复
+max_repo_buffer = 256 * 1024 * 1024  # 多进程时每个仓库在内存中缓存的文本上限（字符数），超过后转存到临时文件
+stats_file = None          # 运行结束时保存统计结果的路径，.prom后缀为Prometheus textfile格式，否则为json
+hashes = ()                # md5之外额外计算并输出的内容哈希，如 ("sha256", "xxhash64")，xxhash64/blake3需要安装对应的库
+detect_cache_db = None     # 编码检测结果的持久缓存（SQLite）路径，多个进程和多次运行共用，None为只在内存中缓存
+incremental_db = None      # 增量转换的指纹库（SQLite）路径，跳过和上次相比没有变化的zip，只输出CRC32变化了的文件，None为不启用
 #######################################################
 
-logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-logger = logging.getLogger(__name__)
-
-class CodeFileInstance:
-    def __init__(self, repo_path: Path, file_path: Path, target_encoding="utf-8"):
-        assert repo_path.exists(), f"{repo_path} is not exists."
-        assert file_path.exists(), f"{file_path} is not exists."
-        self.file_path = file_path
-        file_bytes = file_path.read_bytes()
-        relate_file_path = file_path.relative_to(repo_path)
-        self._name = relate_file_path.stem
-        self._ext = relate_file_path.suffix
-        self._path = str(relate_file_path)
-        self._encoding = api.from_data(file_bytes, mode=2)
-        self.target_encoding = target_encoding
-        text = None
-        if self._encoding is not None:
-            try:
-                data = file_bytes.decode(encoding=self.target_encoding)
-                text = data.encode(encoding=target_encoding).decode(encoding=target_encoding)
-            except Exception as err:
-                sys.stderr.write(f"Error: {str(err)}\n")
-            # text = charset_mnbvc.api.convert_encoding(file_bytes, self._encoding, self.target_encoding)
-            # text可能会转码失败，输出的还是原编码文本
-        self._text = text
-        self._size = file_path.stat().st_size
-        self._md5 = self.__get_content_md5(file_bytes)
-
-    @property
-    def encoding(self):
-        return self._encoding
-
-    @property
-    def size(self):
-        return self._size
-
-    @property
-    def text(self):
-        return self._text
-
-    @property
-    def name(self):
-        return self._name
-
-    @property
-    def ext(self):
-        return self._ext
-
-    @property
-    def path(self):
-        return self._path
-
-    @property
-    def md5(self):
-        return self._md5
-
-    def __get_content_md5(self, content: bytes):
-        m = hs.md5()
-        m.update(content)
-        return m.hexdigest()
-
-    def get_dict(self):
-        return {
-            "plateform": "",
-            "repo_name": "",
-            "name": self.name,
-            "ext": self.ext,
-            "path": self.path,
-            "size": self.size,
-            "source_encoding": self.encoding,
-            "md5": self.md5,
-            "text": self.text
-        }
-
-
-class RepoInstance:
-    def __init__(self, file_path: str, plateform: str):
-        super(RepoInstance, self).__init__()
-        self.file_path = file_path
-        self._plateform = plateform
-        self._files: List[CodeFileInstance] = list()
-
-    @property
-    def name(self):
-        # 不同平台下的仓库名修改这里的name解析
-        if debug_mode is True: print(self.file_path.parts)
-        return self.file_path.parts[name_position]
-
-    @property
-    def files(self):
-        return self._files
-
-    def files_append(self, file_obj: CodeFileInstance):
-        if file_obj.encoding is None:
-            return
-        if not isinstance(file_obj.text, str):
-            return
-        self._files.append(file_obj)
-
-    def get_dict_list(self):
-        ret = list()
-        for f in self.files:
-            dic = f.get_dict()
-            dic['plateform'] = self._plateform
-            dic['repo_name'] = self.name
-            # yield dic
-            ret.append(dic)
-        return ret
-        # return {
-        #     "repo": self.name,
-        #     "files": [f.get_dict() for f in self.files]
-        # }
-
-
-class Zipfile2JsonL:
-    def __init__(self, output_root, target_encoding="utf-8", clean_src_file=False, plateform="github"):
-        if not os.path.exists(output_root): os.makedirs(output_root)
-        self.output = Path(output_root)
-        self.target_encoding = target_encoding
-        self.max_jsonl_size = 500 * 1024 * 1024
-        self.repo_list = list()
-        self.chunk_counter = 0
-        self.clean_src_file = clean_src_file
-        self.plateform = plateform
-
-    def get_zipfile(self, file_path):
-        '''如果是目录，直接当做仓库来处理。如果是zip文件，先解压再当做仓库处理。'''
-        if file_path.is_file():
-            zip_flag = True
-            if file_path.suffix == '.zip':
-                # 因为仓库压缩包的文件名不一定是仓库的文件名，所以专门指定一个路径
-                repo_root = file_path.parent / ('zipout-' + file_path.stem)
-                with zipfile.ZipFile(file_path, "r") as zf:
-                    zf.extractall(repo_root)
-            else:
-                return list()
-        else:
-            zip_flag = False
-            repo_root = file_path
-        file_list = repo_root.rglob("**/*.*")
-        repo = None
-        for file in file_list:
-            if not file.is_file(): continue
-            if repo is None:
-                repo = RepoInstance(file_path=file, plateform=self.plateform)
-            repo.files_append(
-                CodeFileInstance(repo_root, file, self.target_encoding)
-            )
-        if zip_flag is True: # 删除解压出来的文件
-            for d in repo_root.iterdir():
-                if len(list(d.iterdir())) == 0:
-                    d.rmdir()
-                else:
-                    shutil.rmtree(d)
-            repo_root.rmdir()
-        if self.clean_src_file: # 删除源文件
-            if file_path.is_file(): file_path.unlink(missing_ok=True)
-            else: shutil.rmtree(file_path)
-        if repo is None: return list()
-        return repo.get_dict_list()
-
-    def get_jsonl_file(self):
-        return self.output / f"githubcode.{self.chunk_counter}.jsonl"
-
-    def dump_to_jsonl(self, repo_file_info_list):
-        for line in repo_file_info_list:
-            with open(self.get_jsonl_file(), "a", encoding='utf-8')as a:
-                a.write(json.dumps(line, ensure_ascii=False) + "\n")
-            if os.path.getsize(self.get_jsonl_file()) > self.max_jsonl_size:
-                self.chunk_counter += 1
-
-    def __call__(self, root_dir):
-        root_dir = Path(root_dir)
-        assert root_dir.exists(), FileNotFoundError(str(root_dir))
-        file_list = root_dir.rglob("**/*.zip")
-        for file in file_list:
-            start_time = time.perf_counter()
-            repo_file_info_list = self.get_zipfile(file)
-            print("file: ",file,"repo_file_info_list:", len(list(repo_file_info_list)))
-            self.dump_to_jsonl(repo_file_info_list)
-            exec_time = time.perf_counter() - start_time
-            logger.info(f'zip文件 {file} 处理完成，耗时 {exec_time:.2f} 秒')
-            if debug_mode is True: break
-
 
-def process_zips(zip_root, output, clean_src_file, plateform):
-    handler = Zipfile2JsonL(output_root=output, target_encoding="utf-8", clean_src_file=clean_src_file, plateform=plateform)
-    handler(root_dir=zip_root)
+def process_zips(zip_root, output, clean_src_file, plateform, in_memory=False, workers=1, compression=None, split_by_compressed=False, max_file_size=None,
+                 dedup_db=None, dedup_mode="drop", max_repo_buffer=256 * 1024 * 1024, stats_file=None, hashes=(),
+                 near_dup_db=None, near_dup_mode="flag", near_dup_threshold=0.85, incremental_db=None, detect_cache_db=None, output_format="jsonl"):
+    source = ZipSource(in_memory=in_memory, name_position=name_position, debug=debug_mode)
+    handler = Converter(source, PROFILES["generic"], output, platform=plateform, target_encoding="utf-8", clean_src_file=clean_src_file, workers=workers,
+                        compression=compression, split_by_compressed=split_by_compressed, max_file_size=max_file_size, hashes=hashes,
+                        dedup_db=dedup_db, dedup_mode=dedup_mode, max_repo_buffer=max_repo_buffer, stats_file=stats_file,
+                        near_dup_db=near_dup_db, near_dup_mode=near_dup_mode, near_dup_threshold=near_dup_threshold,
+                        incremental_db=incremental_db, detect_cache_db=detect_cache_db, output_format=output_format)
+    handler.run(zip_root, limit=1 if debug_mode is True else None)
 
 
 if __name__ == '__main__':
-    # parser = argparse.ArgumentParser()
-    # parser.add_argument("-i", "--input", required=True, help="输入压缩包的父路径")
-    # parser.add_argument("-o", "--output", required=True, help="输出文件信息JSONL文件夹路径")
-    # parser.add_argument("-c", "--clean_src_file", required=False, action="store_true", help="是否删除源文件，默认为否")
-    # args = parser.parse_args()
-    # process_zips(args.input, args.output, args.clean_src_file, plateform)
-    process_zips(repos_folder, output_folder, clean_src_file, plateform)
+    # 也可以直接使用 python engine.py --source zip --profile generic ...
+    process_zips(repos_folder, output_folder, clean_src_file, plateform, in_memory, workers, compression, split_by_compressed, max_file_size, dedup_db, dedup_mode, max_repo_buffer, stats_file, hashes,
+                 near_dup_db, near_dup_mode, near_dup_threshold, incremental_db, detect_cache_db, output_format)
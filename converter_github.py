@@ -1,181 +1,70 @@
 #!/usr/bin/env python
 # -*- coding:utf-8 -*-
-import os
-import sys
-import glob
 import argparse
-import json
-import shutil
-import logging
-import time
-import zipfile
-import argparse
-import hashlib as hs
-
-from typing import List
-from pathlib import PurePosixPath, Path
-from charset_mnbvc import api
-
-logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-logger = logging.getLogger(__name__)
-
-class CodeFileInstance:
-    def __init__(self, repo_path: Path, file_path: Path, target_encoding="utf-8"):
-        assert repo_path.exists(), f"{repo_path} is not exists."
-        assert file_path.exists(), f"{file_path} is not exists."
-        self.file_path = file_path
-        file_bytes = file_path.read_bytes()
-        relate_file_path = file_path.relative_to(repo_path)
-        self._name = relate_file_path.stem
-        self._ext = relate_file_path.suffix
-        self._path = str(relate_file_path)
-        self._encoding = api.from_data(file_bytes, mode=2)
-        self.target_encoding = target_encoding
-        text = None
-        if self._encoding is not None:
-            try:
-                data = file_bytes.decode(encoding=self.target_encoding)
-                text = data.encode(encoding=target_encoding).decode(encoding=target_encoding)
-            except Exception as err:
-                sys.stderr.write(f"Error: {str(err)}\n")
-            # text = charset_mnbvc.api.convert_encoding(file_bytes, self._encoding, self.target_encoding)
-            # text可能会转码失败，输出的还是原编码文本
-        self._text = text
-        self._size = file_path.stat().st_size
-        self._md5 = self.__get_content_md5(file_bytes)
-
-    @property
-    def encoding(self):
-        return self._encoding
-
-    @property
-    def size(self):
-        return self._size
-
-    @property
-    def text(self):
-        return self._text
-
-    @property
-    def name(self):
-        return self._name
-
-    @property
-    def ext(self):
-        return self._ext
-
-    @property
-    def path(self):
-        return self._path
 
-    @property
-    def md5(self):
-        return self._md5
-
-    def __get_content_md5(self, content: bytes):
-        m = hs.md5()
-        m.update(content)
-        return m.hexdigest()
-
-    def get_dict(self):
-        return {
-            "plateform": "",
-            "repo_name": "",
-            "name": self.name+self.ext,
-            "ext": self.ext,
-            "path": self.path,
-            "size": self.size,
-            "source_encoding": self.encoding,
-            "md5": self.md5,
-            "text": self.text
-        }
-
-
-class Zipfile2JsonL:
-    def __init__(self, chunk_counter, output_root, target_encoding="utf-8", clean_src_file=False, plateform="github", author=""):
-        if not os.path.exists(output_root): os.makedirs(output_root)
-        self.output = Path(output_root)
-        self.target_encoding = target_encoding
-        self.repo_list = list()
-        self.chunk_counter = chunk_counter
-        self.clean_src_file = clean_src_file
-        self.plateform = plateform
-        self.author = author
-
-    def extract_without_unpack(self, zip_path):
-        with zipfile.ZipFile(zip_path, "r") as zf:
-            for Zfile in zf.filelist:
-                try:
-                    if Zfile.is_dir(): continue
-                    filepath = Zfile.filename
-                    code = CodeFileInstance(zip_path, Zfile, target_encoding="utf-8", zf=zf)
-                    if code.encoding is None or not isinstance(code.text, str): continue
-                    dic = code.get_dict()
-                    dic["plateform"] = self.plateform
-                    dic["repo_name"] = self.author + "/" + file.relative_to(repo_root).parts[0]
-                    with open(self.get_jsonl_file(), "a", encoding="utf-8") as a1:
-                        a1.write(json.dumps(dic, ensure_ascii=False) + "\n")
-                except:
-                    pass
-
-    def get_zipfile(self, file_path):
-        '''如果是目录，直接当做仓库来处理。如果是zip文件，先解压再当做仓库处理。'''
-        # 因为仓库压缩包的文件名不一定是仓库的文件名，所以专门指定一个路径
-        repo_root = file_path.parent / ('zipout-' + file_path.stem)
-        try:
-            try:
-                with zipfile.ZipFile(file_path, "r") as zf:
-                    zf.extractall(repo_root)
-            except zipfile.BadZipFile:  # 解压过程中遇到 Bad magic number for central directory 问题的解决办法
-                if repo_root.exists(): shutil.rmtree(repo_root)
-                with open(file_path, 'rb')as r: data=r.read()
-                idx = data.find(b"PK\005\006")
-                data = io.BytesIO(data[:idx+22])
-                with zipfile.ZipFile(data, 'r')as zf:
-                    zf.extractall(repo_root)
-        except:  
-        # 有的压缩包解压会报错。
-            try:
-                self.extract_without_unpack(file_path)
-            except:
-                print("unzip error:",file_path)
-            return
-        file_list = repo_root.rglob("**/*.*")
-        for file in file_list:
-            if not file.is_file(): continue
-            code = CodeFileInstance(repo_root, file, self.target_encoding)
-            if code.encoding is None or not isinstance(code.text, str): continue
-            dic = code.get_dict()
-            dic["plateform"] = self.plateform
-            dic["repo_name"] = self.author + "/" + file.relative_to(repo_root).parts[0]
-            with open(self.get_jsonl_file(), "a", encoding="utf-8") as a1:
-                a1.write(json.dumps(dic, ensure_ascii=False) + "\n")
-        shutil.rmtree(repo_root)  # 删除解压出来的目录
-
-    def get_jsonl_file(self):
-        return self.output / f"githubcode.{chunk_counter}.jsonl"
-
-    def __call__(self, zip_path):
-        #zip_path = Path(zip_path)
-        assert zip_path.exists(), FileNotFoundError(str(root_dir))
-        self.get_zipfile(zip_path)
-        if self.clean_src_file is True:
-            zip_path.unlink()
+from engine import Converter, GithubZipSource, PROFILES
+from author_index import AuthorIndex
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-z", "--zips", type=str, required=True, help="存放zip文件的目录")
     parser.add_argument("-j", "--jsonl", type=str, required=True, help="保存jsonl文件的目录")
     parser.add_argument("-t", "--tfile", type=str, default="./T", help="爬取时使用的T文件目录")
+    parser.add_argument("--tfile_index", type=str, default=None, help="T文件索引（SQLite）的路径，T文件变化后自动重建，默认为 <T文件>.index.sqlite")
     parser.add_argument("-p", "--plateform", type=str, default="github", help="仓库来自哪个平台")
     parser.add_argument("--clean", action="store_true", default=False, help="是否删除源文件")
+    parser.add_argument("--in_memory", action="store_true", default=False, help="直接从zip中读取文件，不解压到磁盘")
+    parser.add_argument("--nested_depth", type=int, default=0, help="展开仓库中的压缩包（比如vendored的zip、tar.gz）的层数，默认为0不展开")
+    parser.add_argument("--max_nested_size", type=int, default=256, help="超过该大小（MB）的嵌套压缩包不展开，默认为256")
+    parser.add_argument("--workers", type=int, default=1, help="并行处理zip的进程数，默认为1")
+    parser.add_argument("--output_format", type=str, default="jsonl", choices=["jsonl", "parquet", "arrow"], help="输出格式，parquet/arrow需要安装pyarrow，默认为jsonl")
+    parser.add_argument("--compression", type=str, default=None, choices=["zstd", "gzip"], help="输出jsonl的压缩格式，zstandard未安装时zstd退回gzip，默认不压缩")
+    parser.add_argument("--max_file_size", type=int, default=None, help="超过该大小（字节）的文件直接跳过，默认不限制")
+    parser.add_argument("--allow_exts", type=str, default=None, help="只处理这些扩展名的文件，逗号分隔，如 .py,.c,.md，默认不限制")
+    parser.add_argument("--hashes", type=str, default=None, help="md5之外额外计算并输出的内容哈希，逗号分隔，如 sha256,xxhash64")
+    parser.add_argument("--dedup_db", type=str, default=None, help="md5去重索引（SQLite）的路径，可跨多次运行、多个平台共用，默认不去重")
+    parser.add_argument("--dedup_mode", type=str, default="drop", choices=["drop", "reference"], help="drop丢弃重复文件，reference保留第一次出现的文件，重复文件只记录引用")
+    parser.add_argument("--near_dup_db", type=str, default=None, help="MinHash/LSH近似去重索引（SQLite）的路径，跨zip、跨多次运行共用，默认不做近似去重")
+    parser.add_argument("--near_dup_mode", type=str, default="flag", choices=["drop", "flag"], help="drop丢弃近似重复的文件，flag保留并在near_dup_of字段记录相似的文件")
+    parser.add_argument("--near_dup_threshold", type=float, default=0.85, help="估计的Jaccard相似度不低于该值时视为近似重复，默认0.85")
+    parser.add_argument("--prefetch", type=int, default=2, help="单进程时后台预读接下来几个zip到内存，0为不预读，默认为2")
+    parser.add_argument("--prefetch_mem", type=int, default=1024, help="预读的zip在内存中的总大小上限（MB），更大的zip不预读，默认为1024")
+    parser.add_argument("--max_repo_buffer", type=int, default=256 * 1024 * 1024, help="多进程时每个仓库在内存中缓存的文本上限（字符数），超过后转存到临时文件")
+    parser.add_argument("--stats_file", type=str, default=None, help="运行结束时保存统计结果的路径，.prom后缀为Prometheus textfile格式，否则为json")
+    parser.add_argument("--resume", action="store_true", default=False, help="从上次中断的地方继续，跳过已完成的zip并截掉写了一半的分片，处理失败的zip（记录在 githubcode.checkpoint.failed）会重新处理")
+    parser.add_argument("--detect_cache_size", type=int, default=100000, help="内存中按md5缓存编码检测结果的条数，0为不缓存，默认为100000")
+    parser.add_argument("--detect_cache_db", type=str, default=None, help="编码检测结果的持久缓存（SQLite）路径，多个进程和多次运行共用，默认不使用")
+    parser.add_argument("--incremental_db", type=str, default=None, help="增量转换的指纹库（SQLite）路径，跳过和上次相比没有变化的zip，"
+                        "变化了的zip中只输出CRC32和上次不同的文件，默认不启用")
+    parser.add_argument("--shard_index", action="store_true", default=False, help="为每个jsonl分片写一个 <分片>.idx 索引，可以用shard_index.py按md5或仓库名/path直接读取记录")
+    parser.add_argument("--split_by_compressed", action="store_true", default=False, help="按压缩后的大小切分jsonl，默认按压缩前的大小")
 
     args = parser.parse_args()
     zipfile_folder = args.zips
     jsonlfile_folder = args.jsonl
     Tfile_path = args.tfile
+    Tfile_index = args.tfile_index
     plateform = args.plateform
     clean_src_file = args.clean
+    in_memory = args.in_memory
+    nested_depth = args.nested_depth
+    max_nested_size = args.max_nested_size * 1024 * 1024
+    workers = args.workers
+    compression = args.compression
+    output_format = args.output_format
+    split_by_compressed = args.split_by_compressed
+    shard_index = args.shard_index
+    max_file_size = args.max_file_size
+    allow_exts = args.allow_exts.split(",") if args.allow_exts else None
+    hashes = args.hashes.split(",") if args.hashes else ()
+    resume = args.resume
+    incremental_db = args.incremental_db
+    detect_cache_size = args.detect_cache_size
+    detect_cache_db = args.detect_cache_db
+    max_repo_buffer = args.max_repo_buffer
+    prefetch_depth = args.prefetch
+    prefetch_mem = args.prefetch_mem * 1024 * 1024
+    stats_file = args.stats_file
 
     print(args)
 
@@ -186,25 +75,16 @@ if __name__ == "__main__":
     #plateform = 'github'       # 仓库来自哪个平台
     #clean_src_file = False     # 是否删除源文件
     ########################################################
-    #公共变量
-    chunk_counter = 0
-
-    p = Path(zipfile_folder)
-    fs = p.glob("**/*.zip")
-    id2author = dict()  # id（压缩包名）和作者对应
-    with open(Tfile_path,"r",encoding="utf-8")as r: data=r.readlines()
-    for line in data:
-        k,v = line.split(", ")
-        v = v.split("/")[3]
-        id2author[k] = v
-    for f in fs:
-        # 已经下载好的仓库没有作者信息，以仓库id信息代替
-        rid = f.stem
-        try:
-            author = id2author[rid]
-            h = Zipfile2JsonL(chunk_counter, jsonlfile_folder, clean_src_file=clean_src_file, plateform=plateform, author=author) 
-            h(f)
-            if os.path.getsize(h.get_jsonl_file()) > 500 * 1024 * 1024:
-                chunk_counter += 1
-        except:
-            pass
\ No newline at end of file
+    # 也可以直接使用 python engine.py --source github --profile github ...
+    id2author = AuthorIndex(Tfile_path, Tfile_index)  # id（压缩包名）和作者对应，T文件中没有的zip跳过
+    source = GithubZipSource(id2author, in_memory=in_memory, nested_depth=nested_depth, max_nested_size=max_nested_size)
+    converter = Converter(source, PROFILES["github"], jsonlfile_folder, platform=plateform, clean_src_file=clean_src_file, workers=workers,
+                          compression=compression, split_by_compressed=split_by_compressed, max_file_size=max_file_size,
+                          allow_exts=allow_exts, hashes=hashes, dedup_db=args.dedup_db, dedup_mode=args.dedup_mode,
+                          near_dup_db=args.near_dup_db, near_dup_mode=args.near_dup_mode, near_dup_threshold=args.near_dup_threshold,
+                          max_repo_buffer=max_repo_buffer, prefetch_depth=prefetch_depth, prefetch_mem=prefetch_mem,
+                          resume=resume, stats_file=stats_file, incremental_db=incremental_db,
+                          detect_cache_size=detect_cache_size, detect_cache_db=detect_cache_db,
+                          output_format=output_format, shard_index=shard_index)
+    converter.run(zipfile_folder)
+    id2author.close()
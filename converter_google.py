@@ -1,220 +1,39 @@
 #!/usr/bin/env python
 # -*- coding:utf-8 -*-
-import os
-import sys
-import argparse
-import json
-import shutil
-import logging
-import time
-import glob
-import zipfile
-import hashlib as hs
-
-from typing import List
-from pathlib import PurePosixPath, Path
-from charset_mnbvc import api
-from datetime import datetime
+from engine import Converter, FolderSource, PROFILES
 
 #######################################################
 # 其他变量
 repos_folder = '/Users/washing/Downloads/google'    # 存放仓库们的目录，目录下是一个个仓库
 output_folder = './out'    # jsonl输出的目录
 clean_src_file = False     # 是否删除源文件
+output_format = "jsonl"    # 输出格式，"jsonl"/"parquet"/"arrow"，parquet/arrow需要安装pyarrow，未安装时退回jsonl
+compression = None         # 输出压缩格式，None/"zstd"/"gzip"，zstandard未安装时zstd退回gzip
+split_by_compressed = False  # 是否按压缩后的大小切分jsonl
+max_file_size = None       # 超过该大小（字节）的文件直接跳过，None为不限制
+dedup_db = None            # md5去重索引（SQLite）的路径，可跨多次运行、多个平台共用，None为不去重
+dedup_mode = "drop"        # "drop"丢弃重复文件，"reference"保留第一次出现的文件，重复文件只记录引用
+near_dup_db = None         # MinHash/LSH近似去重索引（SQLite）的路径，跨zip、跨多次运行共用，None为不做近似去重
+near_dup_mode = "flag"     # "drop"丢弃近似重复的文件，"flag"保留并记录相似的文件
+near_dup_threshold = 0.85  # 估计的Jaccard相似度不低于该值时视为近似重复
+stats_file = None          # 运行结束时保存统计结果的路径，.prom后缀为Prometheus textfile格式，否则为json
+hashes = ()                # md5之外额外计算并输出的内容哈希，如 ("sha256", "xxhash64")，xxhash64/blake3需要安装对应的库
+walk_threads = 8           # 同时读取目录的线程数，仓库在NFS上时可以调大，1为串行遍历
 #######################################################
 
-logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-logger = logging.getLogger(__name__)
-
-class CodeFileInstance:
-    def __init__(self, repo_path: Path, file_path: Path, target_encoding="utf-8"):
-        assert repo_path.exists(), f"{repo_path} is not exists."
-        assert file_path.exists(), f"{file_path} is not exists."
-        self.file_path = file_path
-        file_bytes = file_path.read_bytes()
-        relate_file_path = file_path.relative_to(repo_path)
-        self._name = relate_file_path.stem
-        self._ext = relate_file_path.suffix
-        self._path = str(relate_file_path)
-        self._encoding = api.from_data(file_bytes, mode=2)
-        self.target_encoding = target_encoding
-        text = None
-        if self._encoding is not None:
-            try:
-                data = file_bytes.decode(encoding=self.target_encoding)
-                text = data.encode(encoding=target_encoding).decode(encoding=target_encoding)
-            except Exception as err:
-                sys.stderr.write(f"Error: {str(err)}\n")
-            # text = charset_mnbvc.api.convert_encoding(file_bytes, self._encoding, self.target_encoding)
-            # text可能会转码失败，输出的还是原编码文本
-        self._text = text
-        self._size = file_path.stat().st_size
-        self._md5 = self.__get_content_md5(file_bytes)
-
-    @property
-    def encoding(self):
-        return self._encoding
-
-    @property
-    def size(self):
-        return self._size
-
-    @property
-    def text(self):
-        return self._text
-
-    @property
-    def name(self):
-        return self._name
-
-    @property
-    def ext(self):
-        return self._ext
-
-    @property
-    def path(self):
-        return self._path
-
-    @property
-    def md5(self):
-        return self._md5
-
-    def __get_content_md5(self, content: bytes):
-        m = hs.md5()
-        m.update(content)
-        return m.hexdigest()
-
-    def get_dict(self):
-        return {
-            "来源": "",
-            "仓库名": "",
-            "文件名": self.name,
-            "ext": self.ext,
-            "path": self.path,
-            "size": self.size,
-            "原始编码": self.encoding,
-            "md5": self.md5,
-            "text": self.text,
-            "时间": datetime.now().strftime('%Y%m%d')
-        }
-
-
-#class RepoInstance:
-#    def __init__(self, folder_name: str, plateform: str):
-#        super(RepoInstance, self).__init__()
-#        self.folder_name = folder_name
-#        self._plateform = plateform
-#        self._files: List[CodeFileInstance] = list()
-#
-#    @property
-#    def name(self):
-#        return self.folder_name
-#
-#    @property
-#    def files(self):
-#        return self._files
-#
-#    def files_append(self, file_obj: CodeFileInstance):
-#        if file_obj.encoding is None:
-#            return
-#        if not isinstance(file_obj.text, str):
-#            return
-#        self._files.append(file_obj)
-#
-#    def get_dict_list(self):
-#        ret = list()
-#        for f in self.files:
-#            dic = f.get_dict()
-#            dic['plateform'] = self._plateform
-#            dic['repo_name'] = self.name
-#            # yield dic
-#            ret.append(dic)
-#        return ret
-#        # return {
-#        #     "repo": self.name,
-#        #     "files": [f.get_dict() for f in self.files]
-#        # }
-#
-
-class Zipfile2JsonL:
-    def __init__(self, output_root, target_encoding="utf-8", clean_src_file=False, plateform="github"):
-        if not os.path.exists(output_root): os.makedirs(output_root)
-        self.output = Path(output_root)
-        self.target_encoding = target_encoding
-        self.max_jsonl_size = 500 * 1024 * 1024
-        self.repo_list = list()
-        self.chunk_counter = 0
-        self.clean_src_file = clean_src_file
-        self.plateform = plateform
-
-    def parse_and_save(self, folder):
-        repo_root = Path(folder)
-        file_list = repo_root.rglob("**/*.*")
-        for file in file_list:
-            if file.is_file():
-                code = CodeFileInstance(repo_root, file, self.target_encoding)
-                if code.encoding is not None and isinstance(code.text, str):
-                    dic = code.get_dict()
-                    dic['来源'] = 'google'
-                    dic['仓库名'] = repo_root.parts[-1]
-                    with open(self.get_jsonl_file(), "a", encoding="utf-8")as a:
-                        a.write(json.dumps(dic, ensure_ascii=False) + "\n")
-                    if os.path.getsize(self.get_jsonl_file()) > self.max_jsonl_size:
-                        self.chunk_counter += 1
-        if self.clean_src_file:  # 删除源文件
-            shutil.rmtree(folder)
-
-    def get_jsonl_file(self):
-        return self.output / f"googleSourceCode.{self.chunk_counter}.jsonl"
-
-    #def get_zipfile(self, file_path):
-    #    repo_root = Path(file_path)
-    #    file_list = repo_root.rglob("**/*.*")
-    #    repo = None
-    #    for file in file_list:
-    #        if not file.is_file(): continue
-    #        if repo is None:
-    #            repo = RepoInstance(folder_name=repo_root.parts[-1], plateform=self.plateform)
-    #        repo.files_append(
-    #            CodeFileInstance(repo_root, file, self.target_encoding)
-    #        )
-    #    if self.clean_src_file: # 删除源文件
-    #        if file_path.is_file(): file_path.unlink(missing_ok=True)
-    #        else: shutil.rmtree(file_path)
-    #    return repo.get_dict_list()
-
-    #def dump_to_jsonl(self, repo_file_info_list):
-    #    for line in repo_file_info_list:
-    #        with open(self.get_jsonl_file(), "a", encoding='utf-8')as a:
-    #            a.write(json.dumps(line, ensure_ascii=False) + "\n")
-    #        if os.path.getsize(self.get_jsonl_file()) > self.max_jsonl_size:
-    #            self.chunk_counter += 1
-
-    def __call__(self, root_dir):
-        folder_list = glob.glob(root_dir+"/*")
-        print(root_dir, len(folder_list))
-        for folder in folder_list:
-            if os.path.isdir(folder):
-                logger.info(f'仓库 {folder} 开始处理')
-                start_time = time.perf_counter()
-                #repo_file_info_list = self.get_zipfile(folder)
-                #print("repo: ",folder,"repo_file_info_list:", len(list(repo_file_info_list)))
-                #self.dump_to_jsonl(repo_file_info_list)
-                self.parse_and_save(folder)
-                exec_time = time.perf_counter() - start_time
-                logger.info(f'仓库 {folder} 处理完成，耗时 {exec_time:.2f} 秒')
-
 
-def process_zips(zip_root, output, clean_src_file):
-    handler = Zipfile2JsonL(output_root=output, target_encoding="utf-8", clean_src_file=clean_src_file)
-    handler(root_dir=zip_root)
+def process_zips(zip_root, output, clean_src_file, compression=None, split_by_compressed=False, max_file_size=None,
+                 dedup_db=None, dedup_mode="drop", stats_file=None, hashes=(),
+                 near_dup_db=None, near_dup_mode="flag", near_dup_threshold=0.85, walk_threads=8, output_format="jsonl"):
+    handler = Converter(FolderSource("**/*.*", walk_threads=walk_threads), PROFILES["google"], output, target_encoding="utf-8", clean_src_file=clean_src_file,
+                        compression=compression, split_by_compressed=split_by_compressed, max_file_size=max_file_size, hashes=hashes,
+                        dedup_db=dedup_db, dedup_mode=dedup_mode, stats_file=stats_file,
+                        near_dup_db=near_dup_db, near_dup_mode=near_dup_mode, near_dup_threshold=near_dup_threshold,
+                        output_format=output_format)
+    handler.run(zip_root)
 
 
 if __name__ == '__main__':
-    # parser = argparse.ArgumentParser()
-    # parser.add_argument("-i", "--input", required=True, help="输入压缩包的父路径")
-    # parser.add_argument("-o", "--output", required=True, help="输出文件信息JSONL文件夹路径")
-    # parser.add_argument("-c", "--clean_src_file", required=False, action="store_true", help="是否删除源文件，默认为否")
-    # args = parser.parse_args()
-    # process_zips(args.input, args.output, args.clean_src_file, plateform)
-    process_zips(repos_folder, output_folder, clean_src_file)
+    # 也可以直接使用 python engine.py --source folders --profile google ...
+    process_zips(repos_folder, output_folder, clean_src_file, compression, split_by_compressed, max_file_size, dedup_db, dedup_mode, stats_file, hashes,
+                 near_dup_db, near_dup_mode, near_dup_threshold, walk_threads, output_format)
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+import sys
+
+from stats import stats
+
+# 检测结果的超集编码，检测出的编码解码失败时再试一次
+FALLBACK_ENCODINGS = {
+    "big5": "cp950",
+    "gb2312": "gb18030",
+    "gbk": "gb18030",
+}
+
+
+def decode_text(data: bytes, encoding: str):
+    '''把文件内容解码为str，只生成一个str。
+    先严格按utf-8解码，失败了才用charset_mnbvc检测出的编码解码，都失败时返回None。
+    成功的文件按解码方式计数到decode.utf-8/decode.detected，失败的计数到dropped.decode。'''
+    try:
+        text = data.decode("utf-8")
+        stats.count("decode.utf-8")
+        return text
+    except UnicodeDecodeError:
+        pass
+    candidates = [encoding]
+    fallback = FALLBACK_ENCODINGS.get(encoding.lower())
+    if fallback is not None: candidates.append(fallback)
+    for enc in candidates:
+        try:
+            text = data.decode(enc)
+            stats.count("decode.detected")
+            return text
+        except (UnicodeDecodeError, LookupError) as err:
+            error = err
+    stats.count("dropped.decode")
+    sys.stderr.write(f"Error: {str(error)}\n")
+    return None
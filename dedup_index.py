@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+import sqlite3
+
+from stats import stats
+
+
+class DedupIndex:
+    '''按文件内容md5去重的持久化索引，保存在SQLite中，重启后继续生效，多个进程可以共用同一个数据库。
+    mode为"drop"时直接丢弃重复文件；为"reference"时保留第一次出现的文件，
+    之后的重复文件text置为空字符串，并在ref_key字段中记录第一次出现的 仓库名/path。
+    新记录的文件先缓存在内存中，攒够commit_every个时在一个很短的事务中写入，不会长时间占用写锁让其他进程等锁超时；
+    commit_every为None时只在调用commit()时写入，用于和断点续跑的清单保持一致。'''
+    def __init__(self, db_path, mode="drop", commit_every=1000):
+        assert mode in ("drop", "reference"), f"unknown dedup mode {mode}"
+        self.db_path = str(db_path)
+        self.mode = mode
+        self.commit_every = commit_every
+        self._pending = dict()  # 还没有写入数据库的 md5 -> (repo_name, path)
+        self._conn = sqlite3.connect(self.db_path, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS files (md5 TEXT PRIMARY KEY, repo_name TEXT, path TEXT) WITHOUT ROWID")
+        self._conn.commit()
+
+    def lookup_or_add(self, md5, repo_name, path):
+        '''第一次出现时记录下来并返回None，否则返回第一次出现时的(repo_name, path)'''
+        first = self._pending.get(md5)
+        if first is None: first = self._conn.execute("SELECT repo_name, path FROM files WHERE md5 = ?", (md5,)).fetchone()
+        if first is not None: return first
+        self._pending[md5] = (repo_name, path)
+        if self.commit_every is not None and len(self._pending) >= self.commit_every: self.commit()
+        return None
+
+    def dedup(self, dic, repo_key="repo_name", ref_key="dup_of"):
+        '''返回需要写入的记录，重复且mode为"drop"时返回None'''
+        first = self.lookup_or_add(dic["md5"], dic[repo_key], dic["path"])
+        if first is None: return dic
+        if self.mode == "drop":
+            stats.count("dropped.duplicate")
+            return None
+        stats.count("duplicate.reference")
+        dic["text"] = ""
+        dic[ref_key] = f"{first[0]}/{first[1]}"
+        return dic
+
+    def commit(self):
+        self._conn.executemany("INSERT OR IGNORE INTO files VALUES (?, ?, ?)", ((md5, repo_name, path) for md5, (repo_name, path) in self._pending.items()))
+        self._conn.commit()
+        self._pending = dict()
+
+    def rollback(self):
+        '''丢弃上次commit()之后记录的文件，用于一个输入处理失败时'''
+        self._pending = dict()
+
+    def close(self):
+        self.commit()
+        self._conn.close()
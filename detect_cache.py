@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+import sqlite3
+import logging
+
+from collections import OrderedDict
+from charset_mnbvc import api
+from stats import stats
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+# 进程池中每个工作进程一个缓存，由init_process_cache在进程启动时建立，进程处理的各个任务共用
+_process_cache = None
+
+
+class DetectionCache:
+    '''按内容md5缓存编码检测的结果，fork很多的仓库中大量文件内容相同，只需要检测一次。
+    内存中是最多max_entries项的LRU；db_path不为None时还有一层SQLite中的持久缓存，多个进程和之后的运行共用。
+    新的检测结果先留在内存中，攒够commit_every个时在一个很短的事务中写入，不会长时间占用写锁让其他进程等锁超时。
+    持久缓存出错（比如等锁超时）时只记录警告，按没有缓存处理，不影响检测结果。
+    检测不出编码（None）的结果同样缓存。命中情况记在统计的 detect_cache.hit/disk_hit/miss 中。'''
+    def __init__(self, max_entries=100000, db_path=None, commit_every=256):
+        self.max_entries = max_entries
+        self.db_path = None if db_path is None else str(db_path)
+        self.commit_every = commit_every
+        self._lru = OrderedDict()
+        self._conn = None
+        self._pending = list()  # 还没有写入持久缓存的 (md5, 编码)
+        self._warned = False
+        # 新的数据库切换到WAL时不会等锁，由主进程在启动进程池之前先建好
+        if self.db_path is not None:
+            try:
+                self._db()
+            except sqlite3.Error as err:
+                self._db_error(err)
+
+    def _db(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS detections (md5 TEXT PRIMARY KEY, encoding TEXT) WITHOUT ROWID")
+            conn.commit()
+            self._conn = conn  # 建表成功之后才保留连接，出错时下次重新打开
+        return self._conn
+
+    def _remember(self, md5, encoding):
+        self._lru[md5] = encoding
+        if len(self._lru) > self.max_entries: self._lru.popitem(last=False)
+
+    def _db_error(self, err):
+        stats.count("detect_cache.db_error")
+        # 之后再出错只计数，不重复输出
+        if not self._warned: logger.warning(f"编码检测的持久缓存 {self.db_path} 出错，跳过: {err}")
+        self._warned = True
+        try:
+            if self._conn is not None: self._conn.rollback()
+        except sqlite3.Error:
+            pass
+
+    def _lookup(self, md5):
+        '''在持久缓存中查找，没有或者出错时返回_MISSING'''
+        try:
+            row = self._db().execute("SELECT encoding FROM detections WHERE md5 = ?", (md5,)).fetchone()
+        except sqlite3.Error as err:
+            self._db_error(err)
+            return _MISSING
+        return _MISSING if row is None else row[0]
+
+    def detect(self, data, md5):
+        '''返回data的编码，与 api.from_data(data, mode=2) 相同'''
+        encoding = self._lru.get(md5, _MISSING)
+        if encoding is not _MISSING:
+            self._lru.move_to_end(md5)
+            stats.count("detect_cache.hit")
+            return encoding
+        if self.db_path is not None:
+            encoding = self._lookup(md5)
+            if encoding is not _MISSING:
+                stats.count("detect_cache.disk_hit")
+                self._remember(md5, encoding)
+                return encoding
+        stats.count("detect_cache.miss")
+        encoding = api.from_data(data, mode=2)
+        self._remember(md5, encoding)
+        if self.db_path is not None:
+            self._pending.append((md5, encoding))
+            if len(self._pending) >= self.commit_every: self.commit()
+        return encoding
+
+    def commit(self):
+        '''把新的检测结果写入持久缓存，出错时丢弃这些结果（只是少缓存了一些）'''
+        pending, self._pending = self._pending, list()
+        if not pending: return
+        try:
+            conn = self._db()
+            conn.executemany("INSERT OR IGNORE INTO detections VALUES (?, ?)", pending)
+            conn.commit()
+        except sqlite3.Error as err:
+            self._db_error(err)
+
+    def close(self):
+        self.commit()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    @staticmethod
+    def hit_rate():
+        '''当前统计中的命中率（包括持久缓存的命中），没有检测过时返回None'''
+        hits = stats.counters["detect_cache.hit"] + stats.counters["detect_cache.disk_hit"]
+        total = hits + stats.counters["detect_cache.miss"]
+        return hits / total if total else None
+
+
+def init_process_cache(max_entries, db_path):
+    '''进程池的initializer。缓存不能随任务传给工作进程，否则每个任务拿到的都是一个新的空缓存'''
+    global _process_cache
+    _process_cache = DetectionCache(max_entries, db_path)
+
+
+def process_cache():
+    '''当前进程中由init_process_cache建立的缓存，没有时为None'''
+    return _process_cache
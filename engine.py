@@ -0,0 +1,771 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+'''统一的转换引擎。输入源（zip目录、带T文件的github zip目录、仓库目录、tar/7z等压缩包）和输出字段格式（各平台的schema）都可以替换，
+并行、预读、过滤、哈希、去重、断点续跑、统计等都只在这里实现一次，converter*.py只负责各自的配置。
+
+    python engine.py --source folders --profile arxiv -i /nas2/arxiv/download -o ./out
+    python engine.py --source github --profile github -i ./zips -o ./out -t ./T --workers 8
+'''
+import io
+import os
+import shutil
+import hashlib
+import logging
+import time
+import zipfile
+import argparse
+
+from fnmatch import fnmatchcase
+from pathlib import PurePosixPath, Path
+from collections import deque
+from datetime import datetime
+from charset_mnbvc import api
+from parallel import ordered_map, RecordBuffer, prefetch
+from mapped import truncate_to_eocd
+from walker import ScandirWalker, list_dirs
+from archives import archive_format, archive_stem, iter_members, iter_nested, nested_format, MEMBERS
+from jsonl_writer import ShardedJsonlWriter
+from columnar_writer import ShardedColumnarWriter
+import columnar_writer
+from file_filter import FileFilter
+from decoding import decode_text
+from hashes import ContentHasher
+from stats import stats
+from dedup_index import DedupIndex
+from near_dup import NearDupIndex, SIGNATURE_KEY
+from checkpoint import CheckpointManifest
+from author_index import AuthorIndex
+from fingerprints import FingerprintStore, crc_digest, member_unchanged
+from detect_cache import DetectionCache, init_process_cache, process_cache
+from batch_detect import BatchDetector
+
+logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+class CodeFileInstance:
+    '''读取一个文件，过滤、计算哈希、检测编码并解码。
+    zf为None时file_path是磁盘上的文件；否则直接从压缩包中读取，此时file_path是压缩包中的成员，
+    zf需要提供open(file_path)，file_path需要有filename和file_size（zipfile.ZipFile/ZipInfo或archives.MEMBERS/ArchiveMember）。
+    size为遍历目录时已经得到的文件大小，给出时不再检查和stat磁盘上的文件；detect_cache不为None时按md5缓存编码检测的结果。
+    defer_detect为True时只读取内容，pending为True的文件由调用方（批量）检测编码后调用set_encoding'''
+    def __init__(self, repo_path: Path, file_path: Path, target_encoding="utf-8", zf=None, file_filter: FileFilter = None, hasher: ContentHasher = None,
+                 size=None, detect_cache: DetectionCache = None, defer_detect=False):
+        if zf is None:
+            if size is None:
+                assert repo_path.exists(), f"{repo_path} is not exists."
+                assert file_path.exists(), f"{file_path} is not exists."
+                size = file_path.stat().st_size
+            relate_file_path = file_path.relative_to(repo_path)
+        else:
+            relate_file_path = PurePosixPath(file_path.filename)
+            size = file_path.file_size
+        self.file_path = file_path
+        self._name = relate_file_path.stem
+        self._ext = relate_file_path.suffix
+        self._path = str(relate_file_path)
+        self._size = size
+        self.target_encoding = target_encoding
+        self._encoding = None
+        self._text = None
+        self._md5 = None
+        self._hashes = dict()
+        self._bytes = None
+        # 读取和编码检测之前，先过滤掉二进制文件和过大的文件，被过滤的文件encoding为None
+        stats.count("files.seen")
+        if file_filter is not None and file_filter.skip_by_name(relate_file_path.name, size): return
+        if hasher is None: hasher = ContentHasher()
+        # 边读边计算md5和额外的哈希，第一块内容就判断为二进制时不再读后面的内容
+        skip = file_filter.skip_by_content if file_filter is not None else None
+        if zf is None:
+            file_bytes, hashes = hasher.read_file(file_path, skip, size)
+        else:
+            with zf.open(file_path) as fp:
+                file_bytes, hashes = hasher.read(fp, skip)
+        if file_bytes is None: return
+        stats.count("bytes.in", len(file_bytes))
+        self._md5 = hashes.pop("md5")
+        self._hashes = hashes
+        self._bytes = file_bytes
+        if defer_detect: return
+        t = time.perf_counter()
+        if detect_cache is None:
+            encoding = api.from_data(file_bytes, mode=2)
+        else:
+            encoding = detect_cache.detect(file_bytes, self._md5)
+        stats.lap("detect", t)
+        self.set_encoding(encoding)
+
+    @property
+    def pending(self):
+        '''内容已读取，还没有检测编码'''
+        return self._bytes is not None
+
+    @property
+    def content(self):
+        return self._bytes
+
+    def set_encoding(self, encoding):
+        '''按检测出的编码解码，解码后不再保留读取的内容'''
+        file_bytes, self._bytes = self._bytes, None
+        self._encoding = encoding
+        if encoding is None:
+            stats.count("dropped.undetected")
+            return
+        t = time.perf_counter()
+        # 先按utf-8解码，失败时再按检测出的编码解码，只生成一个str
+        self._text = decode_text(file_bytes, encoding)
+        stats.lap("decode", t)
+
+    @property
+    def encoding(self):
+        return self._encoding
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def text(self):
+        return self._text
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def ext(self):
+        return self._ext
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def md5(self):
+        return self._md5
+
+    @property
+    def hashes(self):
+        return self._hashes
+
+
+class SchemaProfile:
+    '''输出jsonl的字段格式。fields为 (字段名, 取值) 的列表，取值可以是
+    platform/repo/date（同一个仓库内不变）、stem（不带扩展名的文件名）、filename、ext、path、size、encoding、md5、text，
+    以及hashes（额外的内容哈希，字段名为None，按哈希名展开）。'''
+    def __init__(self, prefix, platform, fields, repo_key="repo_name", ref_key="dup_of", near_ref_key="near_dup_of"):
+        self.prefix = prefix
+        self.platform = platform
+        self.fields = fields
+        self.repo_key = repo_key
+        self.ref_key = ref_key
+        self.near_ref_key = near_ref_key
+        self.constant_keys = tuple(key for key, value in fields if value in ("platform", "repo", "date"))
+        self.has_date = any(value == "date" for _, value in fields)
+        # 分片索引中记录的 (md5, 仓库名, path) 字段
+        self.index_keys = tuple(next(key for key, v in fields if v == value) for value in ("md5", "repo", "path"))
+
+    def columns(self, hash_names=(), extra_keys=()):
+        '''列式输出的列 [(列名, "int"/"str")]，hashes按哈希名展开，extra_keys为去重时可能加入的引用字段'''
+        columns = list()
+        for key, value in self.fields:
+            if value == "hashes": columns.extend((name, "str") for name in hash_names)
+            else: columns.append((key, "int" if value == "size" else "str"))
+        return columns + [(key, "str") for key in extra_keys]
+
+    def record(self, code: CodeFileInstance, platform, repo_name, date=None):
+        values = {"platform": platform, "repo": repo_name, "date": date, "stem": code.name, "filename": code.name + code.ext,
+                  "ext": code.ext, "path": code.path, "size": code.size, "encoding": code.encoding, "md5": code.md5, "text": code.text}
+        dic = dict()
+        for key, value in self.fields:
+            if value == "hashes": dic.update(code.hashes)
+            else: dic[key] = values[value]
+        return dic
+
+
+PROFILES = {
+    # converter.py
+    "generic": SchemaProfile("githubcode", "github", [
+        ("plateform", "platform"), ("repo_name", "repo"), ("name", "stem"), ("ext", "ext"), ("path", "path"), ("size", "size"),
+        ("source_encoding", "encoding"), ("md5", "md5"), (None, "hashes"), ("text", "text")]),
+    # converter_github.py
+    "github": SchemaProfile("githubcode", "github", [
+        ("plateform", "platform"), ("repo_name", "repo"), ("name", "filename"), ("ext", "ext"), ("path", "path"), ("size", "size"),
+        ("source_encoding", "encoding"), ("md5", "md5"), (None, "hashes"), ("text", "text")]),
+    # converter_arxiv.py
+    "arxiv": SchemaProfile("arxivCode", "arxiv", [
+        ("来源", "platform"), ("仓库名", "repo"), ("path", "path"), ("文件名", "stem"), ("ext", "ext"), ("size", "size"),
+        ("原始编码", "encoding"), ("md5", "md5"), (None, "hashes"), ("text", "text"), ("时间", "date")],
+        repo_key="仓库名", ref_key="重复于", near_ref_key="近似重复于"),
+    # converter_google.py
+    "google": SchemaProfile("googleSourceCode", "google", [
+        ("来源", "platform"), ("仓库名", "repo"), ("文件名", "stem"), ("ext", "ext"), ("path", "path"), ("size", "size"),
+        ("原始编码", "encoding"), ("md5", "md5"), (None, "hashes"), ("text", "text"), ("时间", "date")],
+        repo_key="仓库名", ref_key="重复于", near_ref_key="近似重复于"),
+}
+
+
+class ZipSource:
+    '''目录下的zip文件，每个zip是一个仓库。解压到zip旁边的 zipout-<zip名> 目录后遍历，处理完删除；
+    in_memory为True时不解压，直接从zip中读取。中央目录损坏的zip截断后再打开，解压失败时改为直接读取。
+    任务为 (zip路径, None)，仓库名取 zipout-<zip名>/<zip内路径> 的第name_position段（以第一个文件为准）。
+    nested_depth大于0时展开仓库中不超过max_nested_size的压缩包（比如vendored的zip），其中的文件路径为 压缩包路径/成员路径。'''
+    prefetchable = True
+
+    def __init__(self, in_memory=False, name_position=2, debug=False, nested_depth=0, max_nested_size=256 * 1024 * 1024):
+        self.in_memory = in_memory
+        self.name_position = name_position
+        self.debug = debug
+        self.nested_depth = nested_depth
+        self.max_nested_size = max_nested_size
+        # 解压出来的目录在本地磁盘上，串行遍历即可
+        self.walker = ScandirWalker(threads=1)
+
+    def tasks(self, root):
+        return [(f, None) for f in sorted(Path(root).rglob("**/*.zip"))]
+
+    def repo_namer(self, task, repo_root):
+        '''返回 zip内相对路径 -> 仓库名 的函数'''
+        name = None
+
+        def namer(relpath):
+            nonlocal name
+            if name is None:
+                parts = (repo_root / relpath).parts
+                # 换新的平台时打开debug，根据输出的路径调整name_position
+                if self.debug: print(parts)
+                name = parts[self.name_position]
+            return name
+        return namer
+
+    def open_zipfile(self, zip_path, data=None):
+        try:
+            return zipfile.ZipFile(zip_path if data is None else io.BytesIO(data), "r")
+        except zipfile.BadZipFile:  # 遇到 Bad magic number for central directory 问题时，截断到中央目录结尾再打开
+            return zipfile.ZipFile(truncate_to_eocd(zip_path, data), "r")
+
+    def walk_in_memory(self, zip_path, namer, data=None):
+        with self.open_zipfile(zip_path, data) as zf:
+            for info in zf.infolist():
+                # 与 repo_root.rglob("**/*.*") 保持一致，只处理文件名中带'.'的文件
+                relpath = PurePosixPath(info.filename)
+                if info.is_dir() or '.' not in relpath.name: continue
+                fmt = nested_format(info.filename, info.file_size, self.nested_depth, self.max_nested_size)
+                if fmt is not None:
+                    yield from self.walk_nested(zf.read(info), fmt, info.filename, zip_path, namer)
+                    continue
+                yield namer(relpath), zip_path, info, zf, info.file_size
+
+    def walk_nested(self, source, fmt, filename, repo_root, namer):
+        for member in iter_nested(source, fmt, filename, self.nested_depth, self.max_nested_size):
+            relpath = PurePosixPath(member.filename)
+            if '.' not in relpath.name: continue
+            yield namer(relpath), repo_root, member, MEMBERS, member.file_size
+
+    def walk(self, task, data=None):
+        '''逐个yield (仓库名, 仓库根目录, 文件, 压缩包, 文件大小)，data是预读到内存中的zip内容，为None时从磁盘读取'''
+        zip_path = task[0]
+        # 因为仓库压缩包的文件名不一定是仓库的文件名，所以专门指定一个路径
+        repo_root = zip_path.parent / ('zipout-' + zip_path.stem)
+        namer = self.repo_namer(task, repo_root)
+        if self.in_memory:
+            yield from self.walk_in_memory(zip_path, namer, data)
+            return
+        try:
+            t = time.perf_counter()
+            try:
+                with self.open_zipfile(zip_path, data) as zf:
+                    zf.extractall(repo_root)
+            except zipfile.BadZipFile:  # 解压过程中遇到 Bad magic number for central directory 问题的解决办法
+                if repo_root.exists(): shutil.rmtree(repo_root)
+                with zipfile.ZipFile(truncate_to_eocd(zip_path, data), "r") as zf:
+                    zf.extractall(repo_root)
+            stats.lap("unzip", t)
+        except Exception:
+            # 有的压缩包解压会报错，改为直接从压缩包中读取
+            if repo_root.exists(): shutil.rmtree(repo_root)
+            yield from self.walk_in_memory(zip_path, namer, data)
+            return
+        try:
+            for file, size in self.walker.walk(repo_root, "**/*.*"):
+                relpath = file.relative_to(repo_root)
+                fmt = nested_format(file.name, size, self.nested_depth, self.max_nested_size)
+                if fmt is not None:
+                    yield from self.walk_nested(file, fmt, relpath.as_posix(), repo_root, namer)
+                    continue
+                yield namer(relpath), repo_root, file, None, size
+        finally:
+            shutil.rmtree(repo_root)  # 删除解压出来的目录
+
+    def member_crcs(self, task, data=None):
+        '''zip中各成员的CRC32，只读取zip结尾的中央目录'''
+        with self.open_zipfile(task[0], data) as zf:
+            return {info.filename: info.CRC for info in zf.infolist() if not info.is_dir()}
+
+    def digest(self, task, data=None):
+        return crc_digest(self.member_crcs(task, data))
+
+    def remove(self, task):
+        task[0].unlink(missing_ok=True)
+
+
+class GithubZipSource(ZipSource):
+    '''converter_github.py的输入：目录下以仓库id命名的zip，作者从T文件中查找，T文件中没有的zip跳过。
+    任务为 (zip路径, 作者)，仓库名为 作者/zip内的第一级目录。'''
+    def __init__(self, authors: AuthorIndex, in_memory=False, nested_depth=0, max_nested_size=256 * 1024 * 1024):
+        super(GithubZipSource, self).__init__(in_memory=in_memory, nested_depth=nested_depth, max_nested_size=max_nested_size)
+        self.authors = authors
+
+    def tasks(self, root):
+        fs = sorted(Path(root).glob("**/*.zip"))
+        return [(f, self.authors[f.stem]) for f in fs if f.stem in self.authors]
+
+    def repo_namer(self, task, repo_root):
+        author = task[1]
+        return lambda relpath: author + "/" + relpath.parts[0]
+
+    def __getstate__(self):
+        # 进程池中只需要任务里带的作者，T文件索引留在主进程
+        state = self.__dict__.copy()
+        state.pop("authors")
+        return state
+
+
+class FolderSource:
+    '''目录下的一个个仓库目录（converter_arxiv.py、converter_google.py的输入），仓库名为目录名，
+    仓库中匹配pattern的文件都会处理，nested_depth大于0时展开其中的压缩包（同ZipSource）。任务为 (仓库目录, None)。
+    目录用os.scandir遍历，walk_threads个线程同时读取多个目录，文件大小取自目录项，减少NFS上的元数据操作。'''
+    prefetchable = False
+
+    def __init__(self, pattern="**/*.*", nested_depth=0, max_nested_size=256 * 1024 * 1024, walk_threads=8):
+        self.pattern = pattern
+        self.nested_depth = nested_depth
+        self.max_nested_size = max_nested_size
+        self.walker = ScandirWalker(threads=walk_threads)
+
+    def tasks(self, root):
+        return [(folder, None) for folder in list_dirs(root)]
+
+    def walk(self, task, data=None):
+        repo_root = task[0]
+        for file, size in self.walker.walk(repo_root, self.pattern):
+            fmt = nested_format(file.name, size, self.nested_depth, self.max_nested_size)
+            if fmt is None:
+                yield repo_root.parts[-1], repo_root, file, None, size
+                continue
+            for member in iter_nested(file, fmt, file.relative_to(repo_root).as_posix(), self.nested_depth, self.max_nested_size):
+                # 压缩包中的文件和目录中的文件一样按pattern过滤
+                if not fnmatchcase(PurePosixPath(member.filename).name, self.pattern[3:]): continue
+                yield repo_root.parts[-1], repo_root, member, MEMBERS, member.file_size
+
+    def remove(self, task):
+        shutil.rmtree(task[0])
+
+
+class ArchiveSource:
+    '''目录下的压缩包（.tar/.tar.gz/.tgz/.tar.bz2/.tar.xz，安装了zstandard时还有.tar.zst，安装了libarchive时还有.7z），
+    每个压缩包是一个仓库，直接从压缩包的数据流中读取，不解压到磁盘。nested_depth大于0时展开仓库中的压缩包。
+    任务为 (压缩包路径, None)。和ZipSource一样由第一个文件决定仓库名：第一个文件在目录中时为它的第一级目录，否则为压缩包名（去掉后缀），
+    同一个压缩包中的文件仓库名相同。'''
+    prefetchable = True
+
+    def __init__(self, nested_depth=0, max_nested_size=256 * 1024 * 1024):
+        self.nested_depth = nested_depth
+        self.max_nested_size = max_nested_size
+
+    def tasks(self, root):
+        # zip由ZipSource处理
+        return [(f, None) for f in sorted(Path(root).rglob("**/*")) if f.is_file() and archive_format(f.name) not in (None, "zip")]
+
+    def walk(self, task, data=None):
+        archive_path = task[0]
+        source, fmt = archive_path if data is None else data, archive_format(archive_path.name)
+        repo_name = None
+        for member in iter_members(source, fmt, nested_depth=self.nested_depth, max_nested_size=self.max_nested_size):
+            if repo_name is None:
+                # tar只能顺序读取，不为了仓库名把整个压缩包多解压一遍
+                parts = PurePosixPath(member.filename).parts
+                repo_name = parts[0] if len(parts) > 1 else archive_stem(archive_path.name)
+            if '.' not in PurePosixPath(member.filename).name: continue
+            yield repo_name, archive_path, member, MEMBERS, member.file_size
+
+    def member_crcs(self, task, data=None):
+        # tar没有中央目录，变化了的压缩包整个重新处理
+        return None
+
+    def digest(self, task, data=None):
+        '''压缩包内容的md5'''
+        md5 = hashlib.md5()
+        if data is not None:
+            md5.update(data)
+        else:
+            with open(task[0], "rb") as r:
+                for chunk in iter(lambda: r.read(1024 * 1024), b""): md5.update(chunk)
+        return md5.hexdigest()
+
+    def remove(self, task):
+        task[0].unlink(missing_ok=True)
+
+
+class Converter:
+    '''把source中的每个任务（一个仓库）转换成profile格式的记录，去重后写入按大小切分的jsonl。
+    workers大于1时用进程池处理仓库，主进程按任务顺序去重和写入，输出与单进程一致；
+    单进程时后台预读接下来的prefetch_depth个输入。每个任务完成后记录到断点续跑的清单，resume为True时跳过已完成的任务。
+    incremental_db不为None时为增量模式（需要source支持digest/member_crcs），跳过和上次运行相比没有变化的输入，
+    变化了的zip中只输出CRC32和上次不同的成员。
+    编码检测的结果按md5缓存在最多detect_cache_size项的LRU中（0为不缓存），detect_cache_db为多个进程和多次运行共用的持久缓存。
+    仓库中的文件每攒够detect_batch个或detect_batch_bytes字节一起检测编码，ASCII和合法UTF-8的内容不经过完整的检测。
+    output_format为"parquet"或"arrow"时输出列式分片（需要pyarrow，未安装时退回jsonl），字段和切分方式与jsonl相同，见ShardedColumnarWriter。
+    shard_index为True时为每个jsonl分片写一个按md5和 仓库名/path 查找记录的索引，见shard_index.py。'''
+    def __init__(self, source, profile: SchemaProfile, output_root, platform=None, target_encoding="utf-8", clean_src_file=False, workers=1,
+                 compression=None, split_by_compressed=False, max_file_size=None, allow_exts=None, hashes=(),
+                 dedup_db=None, dedup_mode="drop", near_dup_db=None, near_dup_mode="flag", near_dup_threshold=0.85,
+                 max_repo_buffer=256 * 1024 * 1024, prefetch_depth=0, prefetch_mem=1024 * 1024 * 1024, resume=False, stats_file=None,
+                 incremental_db=None, detect_cache_size=100000, detect_cache_db=None, detect_batch=256, detect_batch_bytes=4 * 1024 * 1024,
+                 output_format="jsonl", shard_index=False):
+        self.source = source
+        self.profile = profile
+        self.output = Path(output_root)
+        self.platform = platform if platform is not None else profile.platform
+        self.target_encoding = target_encoding
+        self.clean_src_file = clean_src_file
+        self.workers = workers
+        self.max_repo_buffer = max_repo_buffer
+        self.prefetch_depth = prefetch_depth if source.prefetchable else 0
+        self.prefetch_mem = prefetch_mem
+        self.resume = resume
+        self.stats_file = stats_file
+        self.file_filter = FileFilter(allow_exts=allow_exts, max_size=max_file_size)
+        self.hasher = ContentHasher(hashes)
+        self.detect_cache = DetectionCache(detect_cache_size, detect_cache_db) if detect_cache_size > 0 or detect_cache_db else None
+        self.detector = BatchDetector(self.detect_cache)
+        self.detect_batch = detect_batch
+        self.detect_batch_bytes = detect_batch_bytes
+        if output_format != "jsonl" and columnar_writer.pa is None:
+            logger.warning("pyarrow未安装，改用jsonl输出")
+            output_format = "jsonl"
+        if output_format == "jsonl":
+            self.writer = ShardedJsonlWriter(output_root, profile.prefix, 500 * 1024 * 1024,
+                                             compression=compression, split_by_compressed=split_by_compressed,
+                                             constant_keys=profile.constant_keys, index_keys=profile.index_keys if shard_index else None)
+        else:
+            if shard_index: logger.warning("列式输出不需要分片索引，忽略shard_index")
+            # 只有reference/flag模式才会在记录中加入引用字段
+            extra_keys = [profile.ref_key] if dedup_db and dedup_mode == "reference" else []
+            if near_dup_db and near_dup_mode == "flag": extra_keys.append(profile.near_ref_key)
+            self.writer = ShardedColumnarWriter(output_root, profile.prefix, profile.columns(self.hasher.names, extra_keys), fmt=output_format,
+                                                max_size=500 * 1024 * 1024, compression=compression)
+        # 去重索引中一个任务新记录的文件先留在内存中，任务记录到清单之后才写入，处理过程中不占用写锁，
+        # 中途崩溃时也不会在续跑时把这个任务的文件当成自己的重复
+        self.dedup_index = DedupIndex(dedup_db, dedup_mode, commit_every=None) if dedup_db else None
+        self.near_dup_index = NearDupIndex(near_dup_db, near_dup_mode, near_dup_threshold, commit_every=None) if near_dup_db else None
+        # MinHash签名和编码检测一起在进程池中计算，主进程只做LSH的查找和写入
+        self.near_dup_signer = self.near_dup_index.signer() if self.near_dup_index is not None else None
+        if incremental_db is not None:
+            assert hasattr(source, "digest"), f"{type(source).__name__} does not support incremental mode"
+            self.fingerprints = FingerprintStore(incremental_db)
+        else:
+            self.fingerprints = None
+        self.root = None
+        self._digests = dict()
+        manifest_path = self.output / f"{profile.prefix}.checkpoint"
+        resume_from_manifest = resume and manifest_path.exists()
+        self.manifest = CheckpointManifest(manifest_path, resume=resume)
+        if not resume_from_manifest:
+            self.manifest.mark_start(*self.writer.sync())
+        elif self.manifest.position is not None:
+            # 截掉上次最后一个完成的任务之后写了一半的内容
+            self.writer.resume(*self.manifest.position)
+        # 上次崩溃时工作进程留下的大仓库临时文件，只有主进程读取时才会删除
+        for p in self.output.glob(f"{profile.prefix}.*.jsonl.tmp"): p.unlink()
+
+    def records(self, task, data=None, unchanged=None):
+        '''逐个yield一个仓库中可用文件的记录，unchanged为增量模式下和上次相比没有变化、不需要输出的成员'''
+        date = datetime.now().strftime('%Y%m%d') if self.profile.has_date else None
+        batch, batch_bytes = list(), 0
+        for repo_name, repo_root, file, archive, size in self.source.walk(task, data):
+            if unchanged:
+                name = file.filename if archive is not None else file.relative_to(repo_root).as_posix()
+                if member_unchanged(name, unchanged):
+                    stats.count("incremental.unchanged_member")
+                    continue
+            try:
+                code = CodeFileInstance(repo_root, file, self.target_encoding, zf=archive, file_filter=self.file_filter, hasher=self.hasher, size=size,
+                                        defer_detect=True)
+            except Exception:
+                stats.count("dropped.error")
+                continue
+            if not code.pending: continue  # 被过滤掉的文件
+            batch.append((repo_name, code))
+            batch_bytes += len(code.content)
+            if len(batch) >= self.detect_batch or batch_bytes >= self.detect_batch_bytes:
+                yield from self.detect_records(batch, date)
+                batch, batch_bytes = list(), 0
+        yield from self.detect_records(batch, date)
+
+    def detect_records(self, batch, date):
+        '''一起检测一批文件的编码，按原来的顺序yield其中可用文件的记录'''
+        if not batch: return
+        encodings = self.detector.detect([(code.content, code.md5) for _, code in batch])
+        for (repo_name, code), encoding in zip(batch, encodings):
+            code.set_encoding(encoding)
+            if code.encoding is None or not isinstance(code.text, str): continue
+            dic = self.profile.record(code, self.platform, repo_name, date)
+            if self.near_dup_signer is not None and code.text:
+                t = time.perf_counter()
+                # 转成hex，记录转存到临时jsonl时也能保存
+                dic[SIGNATURE_KEY] = self.near_dup_signer(code.text).hex()
+                stats.lap("minhash", t)
+            yield dic
+
+    def write(self, dic):
+        sig = dic.pop(SIGNATURE_KEY, None)
+        if self.dedup_index is not None:
+            dic = self.dedup_index.dedup(dic, repo_key=self.profile.repo_key, ref_key=self.profile.ref_key)
+            if dic is None: return
+        if self.near_dup_index is not None:
+            dic = self.near_dup_index.dedup(dic, repo_key=self.profile.repo_key, ref_key=self.profile.near_ref_key,
+                                            sig=None if sig is None else bytes.fromhex(sig))
+            if dic is None: return
+        self.writer.write(dic)
+
+    def changed_tasks(self, tasks):
+        '''增量模式下去掉和上次相比没有变化的输入：先比较大小和mtime，不同时再比较摘要'''
+        for task in tasks:
+            key = self.fingerprint_key(task)
+            st = os.stat(task[0])
+            if self.fingerprints.same_stat(key, st):
+                stats.count("incremental.unchanged")
+                continue
+            try:
+                digest = self.source.digest(task)
+            except Exception as err:
+                logger.warning(f"{task[0]} 计算摘要失败: {err}")
+                digest = None
+            if digest is not None and self.fingerprints.same_digest(key, st, digest):
+                stats.count("incremental.unchanged")
+                continue
+            self._digests[task[0]] = digest
+            yield task
+
+    def fingerprint_key(self, task):
+        return task[0].relative_to(self.root).as_posix()
+
+    def fingerprint(self, task, data=None):
+        '''增量模式下返回 ((键, 摘要, 成员的CRC32), CRC32和上次相同的成员名集合)，否则返回 (None, None)'''
+        if self.fingerprints is None: return None, None
+        key = self.fingerprint_key(task)
+        try:
+            crcs = self.source.member_crcs(task, data)
+        except Exception:
+            crcs = None
+        unchanged = None
+        if crcs:
+            previous = self.fingerprints.members(key)
+            unchanged = {name for name, crc in crcs.items() if previous.get(name) == crc}
+        return (key, self._digests.pop(task[0], None), crcs), unchanged
+
+    def convert(self, task, data=None, unchanged=None):
+        '''处理并写入一个任务，成功时返回None。读取仓库出错时丢弃这个任务已经写入的内容，返回出错的原因；
+        写入出错（比如磁盘写满、去重索引出错）时直接抛出，不能当成这一个输入的问题跳过'''
+        records = self.records(task, data, unchanged)
+        while True:
+            try:
+                dic = next(records, None)
+            except Exception as err:
+                self.rollback()
+                return err
+            if dic is None: return None
+            self.write(dic)
+
+    def rollback(self):
+        '''丢弃当前任务已经写入的记录和记录到去重索引中的文件'''
+        self.writer.rollback()
+        if self.dedup_index is not None: self.dedup_index.rollback()
+        if self.near_dup_index is not None: self.near_dup_index.rollback()
+
+    def fail(self, task, err):
+        '''处理失败的任务不记录到清单中，续跑时重新处理，原因记录到 <清单>.failed'''
+        logger.error(f"{task[0]} 处理出错: {err}")
+        stats.count("inputs.failed")
+        self.manifest.mark_failed(task[0], err)
+
+    def convert_in_worker(self, item):
+        '''进程池中处理一个任务，item为 (任务, 不需要输出的成员)，返回其中的记录、统计和出错的原因（成功时为None），
+        由主进程按顺序去重和写入'''
+        # 进程池中的converter是主进程的副本，统计清零后随结果一起返回给主进程汇总
+        stats.reset()
+        # 编码检测的缓存在工作进程启动时建立（见run），进程处理的各个任务共用
+        self.detect_cache = process_cache()
+        self.detector = BatchDetector(self.detect_cache)
+        task, unchanged = item
+        records = RecordBuffer(self.max_repo_buffer, self.output, f"{self.profile.prefix}.")
+        error = None
+        try:
+            for dic in self.records(task, unchanged=unchanged):
+                records.append(dic)
+        except Exception as err:
+            records.discard()
+            error = str(err)
+        records.close()
+        if self.detect_cache is not None: self.detect_cache.commit()
+        return records, stats.snapshot(), error
+
+    def __getstate__(self):
+        # 进程池中只需要读取仓库，写入器、去重索引和清单留在主进程；编码检测的缓存由每个工作进程自己建立
+        state = self.__dict__.copy()
+        for key in ("writer", "dedup_index", "near_dup_index", "manifest", "fingerprints", "_digests", "detect_cache", "detector"):
+            state.pop(key)
+        return state
+
+    def finish(self, task, st, start_time, fingerprint=None):
+        '''一个任务的记录全部写入后落盘并记录到清单和指纹库，再删除源文件。
+        先写清单再写入去重索引和指纹库：在这之间崩溃时，续跑不会把这个任务的文件当成重复丢掉，
+        下次增量运行也只是多处理一次这个输入，而不会把它当成没有变化跳过'''
+        position = self.writer.sync()
+        self.manifest.mark_done(task[0], st, *position)
+        if self.dedup_index is not None: self.dedup_index.commit()
+        if self.near_dup_index is not None: self.near_dup_index.commit()
+        if self.detect_cache is not None: self.detect_cache.commit()
+        if fingerprint is not None:
+            key, digest, crcs = fingerprint
+            self.fingerprints.update(key, st, digest, crcs)
+            self.fingerprints.commit()
+        if self.clean_src_file: self.source.remove(task)
+        logger.info(f'{task[0]} 处理完成，耗时 {time.perf_counter() - start_time:.2f} 秒')
+        stats.maybe_report()
+
+    def run(self, root, limit=None):
+        root = Path(root)
+        assert root.exists(), FileNotFoundError(str(root))
+        self.root = root
+        tasks = self.source.tasks(root)
+        if self.resume: tasks = [task for task in tasks if not self.manifest.is_done(task[0])]
+        if self.fingerprints is not None:
+            tasks = list(self.changed_tasks(tasks))
+            self.fingerprints.commit()
+        if limit is not None: tasks = tasks[:limit]
+        start_time = time.perf_counter()
+        if self.workers > 1:
+            # stat需要在处理前取得，clean_src_file时源文件处理完就删除了
+            stat_results = [os.stat(task[0]) for task in tasks]
+            fingerprints = deque()
+
+            def items():
+                # 成员的CRC32在主进程中读取，随任务一起交给进程池
+                for task in tasks:
+                    fingerprint, unchanged = self.fingerprint(task)
+                    fingerprints.append(fingerprint)
+                    yield task, unchanged
+            cache_args = (self.detect_cache.max_entries, self.detect_cache.db_path) if self.detect_cache is not None else None
+            results = ordered_map(self.convert_in_worker, items(), self.workers,
+                                  initializer=init_process_cache if cache_args else None, initargs=cache_args or ())
+            for task, st, (records, snapshot, error) in zip(tasks, stat_results, results):
+                stats.merge(snapshot)
+                fingerprint = fingerprints.popleft()
+                if error is not None:
+                    self.fail(task, error)
+                else:
+                    for dic in records:
+                        self.write(dic)
+                    self.finish(task, st, start_time, fingerprint)
+                start_time = time.perf_counter()
+        else:
+            # 处理当前输入的同时，后台线程从存储上读取接下来的输入
+            for task, (_, data) in zip(tasks, prefetch([task[0] for task in tasks], self.prefetch_depth, self.prefetch_mem)):
+                st = os.stat(task[0])
+                fingerprint, unchanged = self.fingerprint(task, data)
+                error = self.convert(task, data, unchanged)
+                if error is not None:
+                    self.fail(task, error)
+                else:
+                    self.finish(task, st, start_time, fingerprint)
+                start_time = time.perf_counter()
+        self.close()
+
+    def close(self):
+        self.writer.close()
+        self.manifest.close()
+        if self.dedup_index is not None:
+            self.dedup_index.close()
+        if self.near_dup_index is not None:
+            self.near_dup_index.close()
+        if self.fingerprints is not None:
+            self.fingerprints.close()
+        if self.detect_cache is not None:
+            self.detect_cache.close()
+            hit_rate = self.detect_cache.hit_rate()
+            if hit_rate is not None: logger.info(f"编码检测缓存命中率 {hit_rate:.1%}")
+        logger.info(stats.summary())
+        if self.stats_file is not None: stats.export(self.stats_file)
+
+
+def build_source(name, in_memory=False, name_position=2, pattern="**/*.*", tfile=None, tfile_index=None, debug=False,
+                 nested_depth=0, max_nested_size=256 * 1024 * 1024, walk_threads=8):
+    nested = dict(nested_depth=nested_depth, max_nested_size=max_nested_size)
+    if name == "zip": return ZipSource(in_memory=in_memory, name_position=name_position, debug=debug, **nested)
+    if name == "github": return GithubZipSource(AuthorIndex(tfile, tfile_index), in_memory=in_memory, **nested)
+    if name == "folders": return FolderSource(pattern, walk_threads=walk_threads, **nested)
+    if name == "archive": return ArchiveSource(**nested)
+    raise ValueError(f"unknown source {name}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", type=str, required=True, help="输入目录")
+    parser.add_argument("-o", "--output", type=str, required=True, help="保存jsonl文件的目录")
+    parser.add_argument("--source", type=str, default="zip", choices=["zip", "github", "folders", "archive"],
+                        help="输入源：zip为zip目录（converter.py），github为以仓库id命名的zip目录，需要T文件（converter_github.py），"
+                             "folders为仓库目录的父目录（converter_arxiv.py/converter_google.py），"
+                             "archive为tar/tar.gz/tar.zst/7z等压缩包的目录（tar.zst需要zstandard，7z需要libarchive-c）")
+    parser.add_argument("--profile", type=str, default="generic", choices=sorted(PROFILES), help="输出字段格式和分片文件名前缀")
+    parser.add_argument("-p", "--plateform", type=str, default=None, help="仓库来自哪个平台，默认为profile对应的平台")
+    parser.add_argument("-t", "--tfile", type=str, default="./T", help="source为github时使用的T文件")
+    parser.add_argument("--tfile_index", type=str, default=None, help="T文件索引（SQLite）的路径，默认为 <T文件>.index.sqlite")
+    parser.add_argument("--name_position", type=int, default=2, help="source为zip时仓库名在解压路径中的位置")
+    parser.add_argument("--pattern", type=str, default="**/*.*", help="source为folders时仓库中要处理的文件，arxiv为 **/*")
+    parser.add_argument("--walk_threads", type=int, default=8, help="source为folders时同时读取目录的线程数，1为串行遍历，默认为8")
+    parser.add_argument("--clean", action="store_true", default=False, help="是否删除源文件")
+    parser.add_argument("--in_memory", action="store_true", default=False, help="直接从zip中读取文件，不解压到磁盘")
+    parser.add_argument("--nested_depth", type=int, default=0, help="展开仓库中的压缩包（比如vendored的zip）的层数，默认为0不展开")
+    parser.add_argument("--max_nested_size", type=int, default=256, help="超过该大小（MB）的嵌套压缩包不展开，默认为256")
+    parser.add_argument("--workers", type=int, default=1, help="并行处理仓库的进程数，默认为1")
+    parser.add_argument("--output_format", type=str, default="jsonl", choices=["jsonl", "parquet", "arrow"], help="输出格式，parquet/arrow需要安装pyarrow，默认为jsonl")
+    parser.add_argument("--compression", type=str, default=None, choices=["zstd", "gzip"], help="输出的压缩格式，jsonl时zstandard未安装则zstd退回gzip，parquet默认snappy，默认不压缩")
+    parser.add_argument("--shard_index", action="store_true", default=False, help="为每个jsonl分片写一个 <分片>.idx 索引，可以用shard_index.py按md5或仓库名/path直接读取记录")
+    parser.add_argument("--split_by_compressed", action="store_true", default=False, help="按压缩后的大小切分jsonl，默认按压缩前的大小")
+    parser.add_argument("--max_file_size", type=int, default=None, help="超过该大小（字节）的文件直接跳过，默认不限制")
+    parser.add_argument("--allow_exts", type=str, default=None, help="只处理这些扩展名的文件，逗号分隔，如 .py,.c,.md，默认不限制")
+    parser.add_argument("--hashes", type=str, default=None, help="md5之外额外计算并输出的内容哈希，逗号分隔，如 sha256,xxhash64")
+    parser.add_argument("--dedup_db", type=str, default=None, help="md5去重索引（SQLite）的路径，可跨多次运行、多个平台共用，默认不去重")
+    parser.add_argument("--dedup_mode", type=str, default="drop", choices=["drop", "reference"], help="drop丢弃重复文件，reference保留第一次出现的文件，重复文件只记录引用")
+    parser.add_argument("--near_dup_db", type=str, default=None, help="MinHash/LSH近似去重索引（SQLite）的路径，默认不做近似去重")
+    parser.add_argument("--near_dup_mode", type=str, default="flag", choices=["drop", "flag"], help="drop丢弃近似重复的文件，flag保留并记录相似的文件")
+    parser.add_argument("--near_dup_threshold", type=float, default=0.85, help="估计的Jaccard相似度不低于该值时视为近似重复，默认0.85")
+    parser.add_argument("--prefetch", type=int, default=2, help="单进程时后台预读接下来几个输入到内存，0为不预读，默认为2")
+    parser.add_argument("--prefetch_mem", type=int, default=1024, help="预读的输入在内存中的总大小上限（MB），默认为1024")
+    parser.add_argument("--max_repo_buffer", type=int, default=256 * 1024 * 1024, help="多进程时每个仓库在内存中缓存的文本上限（字符数），超过后转存到临时文件")
+    parser.add_argument("--stats_file", type=str, default=None, help="运行结束时保存统计结果的路径，.prom后缀为Prometheus textfile格式，否则为json")
+    parser.add_argument("--resume", action="store_true", default=False, help="从上次中断的地方继续，跳过已完成的输入并截掉写了一半的分片，处理失败的输入（记录在 <前缀>.checkpoint.failed）会重新处理")
+    parser.add_argument("--detect_cache_size", type=int, default=100000, help="内存中按md5缓存编码检测结果的条数，0为不缓存，默认为100000")
+    parser.add_argument("--detect_batch", type=int, default=256, help="一起检测编码的文件数，ASCII和合法UTF-8的文件不经过完整的检测，默认为256")
+    parser.add_argument("--detect_cache_db", type=str, default=None, help="编码检测结果的持久缓存（SQLite）路径，多个进程和多次运行共用，默认不使用")
+    parser.add_argument("--incremental_db", type=str, default=None, help="增量转换的指纹库（SQLite）路径，跳过和上次相比没有变化的zip/压缩包，"
+                        "zip中只输出CRC32变化了的文件，默认不启用")
+    args = parser.parse_args()
+
+    source = build_source(args.source, in_memory=args.in_memory, name_position=args.name_position, pattern=args.pattern,
+                          tfile=args.tfile, tfile_index=args.tfile_index, nested_depth=args.nested_depth,
+                          max_nested_size=args.max_nested_size * 1024 * 1024, walk_threads=args.walk_threads)
+    converter = Converter(source, PROFILES[args.profile], args.output, platform=args.plateform, clean_src_file=args.clean, workers=args.workers,
+                          compression=args.compression, split_by_compressed=args.split_by_compressed, max_file_size=args.max_file_size,
+                          allow_exts=args.allow_exts.split(",") if args.allow_exts else None,
+                          hashes=args.hashes.split(",") if args.hashes else (),
+                          dedup_db=args.dedup_db, dedup_mode=args.dedup_mode,
+                          near_dup_db=args.near_dup_db, near_dup_mode=args.near_dup_mode, near_dup_threshold=args.near_dup_threshold,
+                          max_repo_buffer=args.max_repo_buffer, prefetch_depth=args.prefetch, prefetch_mem=args.prefetch_mem * 1024 * 1024,
+                          resume=args.resume, stats_file=args.stats_file, incremental_db=args.incremental_db,
+                          detect_cache_size=args.detect_cache_size, detect_cache_db=args.detect_cache_db,
+                          detect_batch=args.detect_batch, output_format=args.output_format, shard_index=args.shard_index)
+    converter.run(args.input)
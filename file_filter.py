@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+import os
+
+from stats import stats
+
+# 肯定不是文本的扩展名，直接跳过，不读取也不做编码检测。
+# 同一个扩展名也可能是文本格式的（比如.obj也是Wavefront模型）不放在这里，由skip_by_content按内容判断
+DENY_EXTS = {
+    # 图片、音视频、字体
+    ".png", ".jpg", ".jpeg", ".gif", ".bmp", ".ico", ".icns", ".tif", ".tiff", ".webp", ".psd",
+    ".mp3", ".wav", ".flac", ".ogg", ".mp4", ".avi", ".mov", ".mkv", ".webm",
+    ".ttf", ".otf", ".woff", ".woff2", ".eot",
+    # 压缩包、安装包
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".rar", ".zst", ".jar", ".war", ".apk", ".whl", ".deb", ".rpm", ".dmg", ".iso",
+    # 编译产物、库
+    ".so", ".dll", ".dylib", ".exe", ".o", ".a", ".lib", ".class", ".pyc", ".pyo", ".wasm", ".bin",
+    # 文档、数据库、模型权重
+    ".pdf", ".doc", ".docx", ".xls", ".xlsx", ".ppt", ".pptx", ".db", ".sqlite", ".mdb",
+    ".pt", ".pth", ".ckpt", ".h5", ".onnx", ".pb", ".npy", ".npz", ".pkl", ".safetensors", ".parquet",
+}
+
+# 常见二进制格式的文件头，这些格式的前几KB里不一定有NUL字节
+MAGIC_NUMBERS = (
+    b"\x89PNG", b"\xff\xd8\xff", b"GIF87a", b"GIF89a", b"PK\x03\x04", b"\x7fELF", b"\xca\xfe\xba\xbe",
+    b"\x1f\x8b", b"\xfd7zXZ", b"7z\xbc\xaf", b"\x28\xb5\x2f\xfd", b"Rar!", b"%PDF-", b"\x00asm", b"SQLite format 3",
+)
+
+# 带BOM的UTF-16/32文本本身就含有NUL字节，不能当做二进制
+UTF16_32_BOMS = (b"\xff\xfe", b"\xfe\xff", b"\x00\x00\xfe\xff")
+
+
+class FileFilter:
+    '''在读取文件和编码检测之前过滤掉二进制文件和过大的文件，跳过的文件按原因计数到dropped.<原因>。
+    allow_exts不为None时只保留这些扩展名的文件；max_size为None时不限制文件大小。'''
+    def __init__(self, deny_exts=DENY_EXTS, allow_exts=None, max_size=None, sniff_size=8192):
+        self.deny_exts = {e.lower() for e in deny_exts}
+        self.allow_exts = None if allow_exts is None else {e.lower() for e in allow_exts}
+        self.max_size = max_size
+        self.sniff_size = sniff_size
+
+    def skip_by_name(self, name: str, size: int) -> bool:
+        '''只根据文件名和大小（stat或ZipInfo.file_size）判断，不需要读取文件内容'''
+        ext = os.path.splitext(name)[1].lower()
+        if ext in self.deny_exts or (self.allow_exts is not None and ext not in self.allow_exts):
+            stats.count("dropped.ext")
+            return True
+        if self.max_size is not None and size > self.max_size:
+            stats.count("dropped.size")
+            return True
+        return False
+
+    def skip_by_content(self, data: bytes) -> bool:
+        '''检查文件开头的几KB，有NUL字节或者是已知的二进制文件头就跳过'''
+        head = data[:self.sniff_size]
+        if head.startswith(MAGIC_NUMBERS):
+            stats.count("dropped.magic")
+            return True
+        if b"\x00" in head and not head.startswith(UTF16_32_BOMS):
+            stats.count("dropped.binary")
+            return True
+        return False
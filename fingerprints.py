@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+import hashlib
+import sqlite3
+
+
+def crc_digest(crcs):
+    '''由zip中央目录里各成员的CRC32计算整个输入的摘要，和成员的顺序无关'''
+    md5 = hashlib.md5()
+    for name in sorted(crcs):
+        md5.update(f"{name}\0{crcs[name]}\n".encode("utf-8", "surrogateescape"))
+    return md5.hexdigest()
+
+
+def member_unchanged(name, unchanged):
+    '''name或它所在的嵌套压缩包（name的某个前缀）在unchanged中'''
+    while True:
+        if name in unchanged: return True
+        idx = name.rfind("/")
+        if idx < 0: return False
+        name = name[:idx]
+
+
+class FingerprintStore:
+    '''增量转换用的指纹库，保存在SQLite中，跨多次运行（比如每月重新爬取后）持续生效。
+    每个输入记录大小、mtime和摘要，zip还记录每个成员的CRC32（直接取自中央目录，不需要解压）。
+    大小和mtime都没变时直接认为没有变化；否则以摘要为准，摘要相同的输入也跳过，只更新大小和mtime。
+    变化了的zip中只处理CRC32和上次不同的成员。update之后只在调用commit()时提交，和断点续跑的清单保持一致。'''
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self._conn = sqlite3.connect(self.db_path, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS inputs (key TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, digest TEXT) WITHOUT ROWID")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS members (input TEXT, name TEXT, crc INTEGER, PRIMARY KEY (input, name)) WITHOUT ROWID")
+        self._conn.commit()
+
+    def _row(self, key):
+        return self._conn.execute("SELECT size, mtime, digest FROM inputs WHERE key = ?", (key,)).fetchone()
+
+    def same_stat(self, key, st):
+        row = self._row(key)
+        return row is not None and row[0] == st.st_size and row[1] == st.st_mtime_ns
+
+    def same_digest(self, key, st, digest):
+        '''摘要和上次相同时更新大小和mtime，下次直接按大小和mtime判断'''
+        row = self._row(key)
+        if row is None or row[2] != digest: return False
+        self._conn.execute("UPDATE inputs SET size = ?, mtime = ? WHERE key = ?", (st.st_size, st.st_mtime_ns, key))
+        return True
+
+    def members(self, key):
+        '''上次记录的 成员名 -> CRC32'''
+        return dict(self._conn.execute("SELECT name, crc FROM members WHERE input = ?", (key,)))
+
+    def update(self, key, st, digest, crcs=None):
+        self._conn.execute("INSERT OR REPLACE INTO inputs VALUES (?, ?, ?, ?)", (key, st.st_size, st.st_mtime_ns, digest))
+        self._conn.execute("DELETE FROM members WHERE input = ?", (key,))
+        if crcs: self._conn.executemany("INSERT INTO members VALUES (?, ?, ?)", ((key, name, crc) for name, crc in crcs.items()))
+
+    def commit(self):
+        self._conn.commit()
+
+    def close(self):
+        self.commit()
+        self._conn.close()
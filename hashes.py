@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+import os
+import time
+import hashlib
+import logging
+
+from stats import stats
+from mapped import map_file
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+logger = logging.getLogger(__name__)
+
+# 可选的内容哈希，值为创建哈希对象的函数；hashlib中保证可用的算法都可以用
+OPTIONAL_HASHES = {
+    "xxhash64": (lambda: xxhash.xxh64()) if xxhash is not None else None,
+    "blake3": (lambda: blake3.blake3()) if blake3 is not None else None,
+}
+
+
+class ContentHasher:
+    '''读取文件内容的同时计算各个哈希，每块数据读出来后依次交给所有哈希对象，整个文件只过一遍。
+    md5总是计算（输出的md5字段和去重都依赖它），names是额外输出的哈希，作为同名字段写入记录。
+    磁盘上不小于mmap_threshold的文件用mmap映射后直接在映射的缓冲区上计算哈希。'''
+    def __init__(self, names=(), chunk_size=1024 * 1024, mmap_threshold=16 * 1024 * 1024):
+        self.names = list()
+        for name in names:
+            if name == "md5" or name in self.names: continue
+            if name in OPTIONAL_HASHES:
+                if OPTIONAL_HASHES[name] is None:
+                    logger.warning(f"{name}所需的库未安装，不计算{name}")
+                    continue
+            else:
+                assert name in hashlib.algorithms_guaranteed, f"unknown hash {name}"
+            self.names.append(name)
+        self.chunk_size = chunk_size
+        self.mmap_threshold = mmap_threshold
+
+    def _new(self, name):
+        if name in OPTIONAL_HASHES: return OPTIONAL_HASHES[name]()
+        return hashlib.new(name)
+
+    def _hashers(self):
+        return [("md5", hashlib.md5())] + [(name, self._new(name)) for name in self.names]
+
+    def read(self, fp, skip=None):
+        '''分块读取fp，边读边计算哈希，返回(内容, {哈希名: 十六进制摘要})，md5也在其中。
+        skip用来检查第一块数据（比如FileFilter.skip_by_content），返回True时不再读后面的内容，返回(None, None)'''
+        hashers = self._hashers()
+        chunks = list()
+        t = time.perf_counter()
+        while True:
+            chunk = fp.read(self.chunk_size)
+            t = stats.lap("read", t)
+            if not chunks and skip is not None and skip(chunk): return None, None
+            if not chunk: break
+            for _, h in hashers: h.update(chunk)
+            t = stats.lap("hash", t)
+            chunks.append(chunk)
+        data = chunks[0] if len(chunks) == 1 else b"".join(chunks)
+        return data, {name: h.hexdigest() for name, h in hashers}
+
+    def read_file(self, path, skip=None, size=None):
+        '''同read，读取磁盘上的文件，size为已知的文件大小。大文件映射到内存，哈希直接在映射上分块计算，
+        只在确定不跳过之后复制一次作为返回的内容，不会像分块读取再拼接那样同时占用两份内存'''
+        if (size if size is not None else os.path.getsize(path)) < self.mmap_threshold:
+            with open(path, "rb") as fp:
+                return self.read(fp, skip)
+        t = time.perf_counter()
+        mm = map_file(path)
+        try:
+            if skip is not None and skip(mm[:self.chunk_size]): return None, None
+            hashers = self._hashers()
+            with memoryview(mm) as view:
+                for i in range(0, len(view), self.chunk_size):
+                    for _, h in hashers: h.update(view[i:i + self.chunk_size])
+            t = stats.lap("hash", t)
+            data = mm[:]
+            stats.lap("read", t)
+        finally:
+            if not isinstance(mm, bytes): mm.close()
+        return data, {name: h.hexdigest() for name, h in hashers}
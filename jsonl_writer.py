@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+import os
+import gzip
+import time
+import logging
+
+from pathlib import Path
+from stats import stats
+from serializer import RecordEncoder
+from shard_index import ShardIndex, index_path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+
+class _CountingFile:
+    '''包一层文件对象，在内存中累计写入的字节数，避免每次都tell()'''
+    def __init__(self, fp, size):
+        self.fp = fp
+        self.size = size
+
+    def write(self, data):
+        self.size += len(data)
+        return self.fp.write(data)
+
+    def flush(self):
+        self.fp.flush()
+
+    def fileno(self):
+        return self.fp.fileno()
+
+    def close(self):
+        self.fp.close()
+
+
+class ShardedJsonlWriter:
+    '''按大小切分的jsonl写入器。
+    整个运行期间只保持一个带缓冲的文件句柄，已写入的字节数在内存中累计，
+    超过max_jsonl_size后切换到下一个分片。只在切换分片、sync和关闭时flush+fsync。
+    compression可选"zstd"或"gzip"，边写边压缩，zstandard没有安装时zstd退回gzip；
+    split_by_compressed为True时按压缩后的大小切分，否则按压缩前的大小切分。
+    constant_keys是同一个仓库内不变的字段，序列化时只在值变化时重新编码，见serializer.RecordEncoder。
+    index_keys为 (md5字段, 仓库名字段, path字段) 时，为每个分片写一个 <分片>.idx 索引，见shard_index.ShardIndex。
+    输出目录中已经有分片时，从第一个没有用过的序号开始写，不会追加到已有的分片中（断点续跑时由resume()决定）。'''
+    def __init__(self, output_root, prefix, max_jsonl_size=500 * 1024 * 1024, chunk_counter=0, buffer_size=8 * 1024 * 1024,
+                 compression=None, split_by_compressed=False, constant_keys=(), index_keys=None):
+        if not os.path.exists(output_root): os.makedirs(output_root)
+        if compression == "zstd" and zstandard is None:
+            logger.warning("zstandard未安装，改用gzip压缩")
+            compression = "gzip"
+        assert compression in (None, "zstd", "gzip"), f"unknown compression {compression}"
+        self.output = Path(output_root)
+        self.prefix = prefix
+        self.max_jsonl_size = max_jsonl_size
+        self.chunk_counter = chunk_counter
+        self.buffer_size = buffer_size
+        self.compression = compression
+        self.split_by_compressed = split_by_compressed
+        self.encoder = RecordEncoder(constant_keys)
+        self._raw = None  # 磁盘上的分片文件
+        self._fp = None   # 写入的流，不压缩时就是_raw
+        self._size = 0
+        self._resume_size = None  # 断点续跑时分片压缩前的大小，压缩后的文件大小不能用来按压缩前的大小切分
+        self._synced = None       # 上次sync()的位置，rollback()时回到这里
+        self._unsynced = 0        # 上次sync()之后写入的记录数
+        self.index_keys = index_keys
+        self._index = None
+        self._frame_start = 0  # 当前frame/member在分片文件中的起始位置
+        self._frame_pos = 0    # 当前frame/member中已写入的（压缩前的）字节数
+        used = [idx for idx, _ in self._shards()]
+        if used: self.chunk_counter = max(self.chunk_counter, max(used) + 1)
+
+    @property
+    def suffix(self):
+        return {None: ".jsonl", "zstd": ".jsonl.zst", "gzip": ".jsonl.gz"}[self.compression]
+
+    def _shards(self):
+        '''输出目录中已有的 (序号, 路径)'''
+        for p in self.output.glob(f"{self.prefix}.*{self.suffix}"):
+            idx = p.name[len(self.prefix) + 1:-len(self.suffix)]
+            if idx.isdigit(): yield int(idx), p
+
+    def get_jsonl_file(self):
+        return self.output / f"{self.prefix}.{self.chunk_counter}{self.suffix}"
+
+    def _open(self):
+        if self._raw is None:
+            raw = open(self.get_jsonl_file(), "ab", buffering=self.buffer_size)
+            # 追加到已有分片时，从已有的大小开始累计
+            self._size = raw.tell() if self._resume_size is None else self._resume_size
+            self._resume_size = None
+            self._raw = _CountingFile(raw, raw.tell())
+            if self._synced is None: self._synced = (self.chunk_counter, self._raw.size, self._size)
+            if self.index_keys is not None: self._index = ShardIndex(index_path(self.get_jsonl_file()))
+        # 压缩分片追加时会新开一个frame/member
+        self._frame_start = self._raw.size
+        self._frame_pos = 0
+        if self.compression is None:
+            self._fp = self._raw
+        elif self.compression == "zstd":
+            self._fp = zstandard.ZstdCompressor().stream_writer(self._raw, closefd=False)
+        else:
+            # 头部的时间固定为0，相同的输入得到完全相同的分片
+            self._fp = gzip.GzipFile(fileobj=self._raw, mode="ab", mtime=0)
+
+    def _end_stream(self):
+        if self._fp is not None and self._fp is not self._raw:
+            self._fp.close()  # 写入压缩流的结尾，不会关闭底层文件
+        self._fp = None
+
+    def _close(self):
+        if self._raw is None: return
+        self._end_stream()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._raw.close()
+        self._raw = None
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+
+    def _current_size(self):
+        if self.split_by_compressed and self.compression is not None:
+            return self._raw.size
+        return self._size
+
+    def write_bytes(self, data: bytes, key=None):
+        '''写入一行已经按utf-8编码好的jsonl（包含结尾的换行符），key为索引中的 (md5, 仓库名, path)'''
+        start = time.perf_counter()
+        if self._fp is None: self._open()
+        if self._index is not None:
+            if self.compression is None:
+                self._index.add(*(key or (None, None, None)), self._raw.size, 0, len(data))
+            else:
+                self._index.add(*(key or (None, None, None)), self._frame_start, self._frame_pos, len(data))
+        self._fp.write(data)
+        self._size += len(data)
+        self._frame_pos += len(data)
+        stats.lap("write", start)
+        stats.count("files.kept")
+        stats.count("bytes.out", len(data))
+        self._unsynced += 1
+        if self._current_size() > self.max_jsonl_size:
+            self._close()
+            self.chunk_counter += 1
+
+    def write(self, dic):
+        start = time.perf_counter()
+        data = self.encoder.encode(dic)
+        stats.lap("serialize", start)
+        self.write_bytes(data, None if self.index_keys is None else tuple(dic.get(k) for k in self.index_keys))
+
+    def sync(self):
+        '''把已写入的内容落盘，返回(分片序号, 该分片已落盘的字节数, 压缩前的字节数)，用于断点续跑。
+        压缩输出会在这里结束当前的frame/member，保证截断到这个位置后仍是完整的压缩文件。'''
+        if self._raw is None:
+            path = self.get_jsonl_file()
+            if not path.exists(): return self.chunk_counter, 0, 0
+            size = path.stat().st_size
+            if self._resume_size is not None: return self.chunk_counter, size, self._resume_size
+            # 追加到已有的压缩分片时不知道压缩前的大小
+            return self.chunk_counter, size, size if self.compression is None else None
+        self._end_stream()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        if self._index is not None: self._index.commit()
+        self._synced = (self.chunk_counter, self._raw.size, self._size)
+        self._unsynced = 0
+        return self._synced
+
+    def rollback(self):
+        '''丢弃上次sync()之后写入的内容（包括其间切换出的分片），用于一个输入处理失败时'''
+        if self._synced is None: return  # 还没有写入过
+        stats.count("files.kept", -self._unsynced)
+        stats.count("files.rolled_back", self._unsynced)
+        self._unsynced = 0
+        self._close()
+        self.resume(*self._synced)
+
+    def resume(self, chunk_counter, offset, size=None):
+        '''断点续跑：回到chunk_counter分片的offset处继续写，丢弃其后写了一半的内容和更后面的分片。
+        size为sync()返回的压缩前的字节数，之后按它继续累计；为None时（旧的清单）按截断后的文件大小累计'''
+        assert self._raw is None, "resume() must be called before writing"
+        self.chunk_counter = chunk_counter
+        self._resume_size = size
+        path = self.get_jsonl_file()
+        if path.exists(): os.truncate(path, offset)
+        if self.index_keys is not None:
+            index = ShardIndex(index_path(path))
+            index.truncate(offset)
+            index.close()
+        for idx, p in list(self._shards()):
+            if idx > chunk_counter:
+                p.unlink()
+                index_path(p).unlink(missing_ok=True)
+
+    def close(self):
+        self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
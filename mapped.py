@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+import io
+import mmap
+
+
+class BufferFile(io.RawIOBase):
+    '''把bytes/mmap/memoryview包装成只读的文件对象，读取时直接从原缓冲区拷贝，不需要先复制一份到BytesIO'''
+    def __init__(self, buffer):
+        super(BufferFile, self).__init__()
+        self._view = memoryview(buffer)
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET: self._pos = offset
+        elif whence == io.SEEK_CUR: self._pos += offset
+        elif whence == io.SEEK_END: self._pos = len(self._view) + offset
+        else: raise ValueError(f"invalid whence {whence}")
+        if self._pos < 0: raise ValueError("negative seek position")
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        self._view.release()
+        super(BufferFile, self).close()
+
+
+def map_file(path):
+    '''只读映射整个文件，空文件不能映射，返回b""'''
+    with open(path, "rb") as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return b""
+
+
+def truncate_to_eocd(zip_path, data=None):
+    '''遇到 Bad magic number for central directory 问题时，把zip截断到第一个中央目录结尾记录之后再打开。
+    data为预读的内容，为None时映射磁盘上的文件，截断用memoryview切片，整个压缩包不会被复制。'''
+    buffer = map_file(zip_path) if data is None else data
+    idx = buffer.find(b"PK\005\006")
+    return BufferFile(memoryview(buffer)[:idx + 22])
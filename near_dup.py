@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+import re
+import time
+import zlib
+import random
+import struct
+import sqlite3
+import logging
+
+from functools import partial
+from stats import stats
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+_TOKEN = re.compile(r"\w+")
+_MERSENNE = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_MASK64 = (1 << 64) - 1
+
+# 进程池中预先计算的签名（hex）在记录中的字段名，主进程写入前取出
+SIGNATURE_KEY = "_minhash"
+
+
+def shingle_hashes(text, shingle_size=5):
+    '''把text规范化为小写的词序列（忽略空白和标点的差异），返回每shingle_size个连续词的crc32集合'''
+    tokens = _TOKEN.findall(text.lower())
+    return {zlib.crc32(" ".join(tokens[i:i + shingle_size]).encode("utf-8"))
+            for i in range(len(tokens) - shingle_size + 1)}
+
+
+def text_signature(text, minhasher, shingle_size=5):
+    '''text的MinHash签名，文件太短（不足一个shingle）时返回空的bytes。只依赖参数，可以在进程池中计算'''
+    hashes = shingle_hashes(text, shingle_size)
+    if not hashes: return b""
+    return minhasher.signature(hashes)
+
+
+class MinHasher:
+    '''用num_perm个 (a*x+b) mod 2^61-1 的哈希函数计算MinHash签名。
+    安装了NumPy时按批向量化计算，否则逐个计算，两种方式得到的签名完全相同，索引可以混用。'''
+    def __init__(self, num_perm=128, seed=1, batch_size=4096):
+        rnd = random.Random(seed)
+        self.num_perm = num_perm
+        self.batch_size = batch_size
+        self.a = [rnd.randint(1, _MERSENNE - 1) for _ in range(num_perm)]
+        self.b = [rnd.randint(0, _MERSENNE - 1) for _ in range(num_perm)]
+        if np is not None:
+            self._a = np.array(self.a, dtype=np.uint64)
+            self._b = np.array(self.b, dtype=np.uint64)
+        else:
+            logger.warning("NumPy未安装，MinHash签名逐个计算，速度较慢")
+
+    def signature(self, hashes):
+        '''返回签名的bytes（num_perm个小端uint32）'''
+        if np is not None:
+            hv = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+            sig = np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+            with np.errstate(over="ignore"):
+                for i in range(0, len(hv), self.batch_size):
+                    batch = hv[i:i + self.batch_size, None]
+                    phv = (batch * self._a + self._b) % np.uint64(_MERSENNE) & np.uint64(_MAX_HASH)
+                    np.minimum(sig, phv.min(axis=0), out=sig)
+            return sig.astype("<u4").tobytes()
+        sig = [min([(((a * x + b) & _MASK64) % _MERSENNE) & _MAX_HASH for x in hashes], default=_MAX_HASH)
+               for a, b in zip(self.a, self.b)]
+        return struct.pack(f"<{self.num_perm}I", *sig)
+
+
+def jaccard(sig1, sig2):
+    '''由两个签名估计Jaccard相似度'''
+    if np is not None:
+        return float(np.mean(np.frombuffer(sig1, dtype="<u4") == np.frombuffer(sig2, dtype="<u4")))
+    n = len(sig1) // 4
+    return sum(sig1[i * 4:i * 4 + 4] == sig2[i * 4:i * 4 + 4] for i in range(n)) / n
+
+
+class NearDupIndex:
+    '''基于MinHash/LSH的近似去重索引，保存在SQLite中，跨zip、跨多次运行持续生效。
+    签名按bands切成若干段，任意一段相同的文件作为候选，再用签名估计Jaccard相似度，不低于threshold的视为近似重复。
+    mode为"drop"时丢弃近似重复的文件；为"flag"时保留，并在ref_key字段中记录相似文件的 仓库名/path。
+    新加入的文件先缓存在内存中，攒够commit_every个时在一个很短的事务中写入，不会长时间占用写锁；
+    commit_every为None时只在调用commit()时写入，用于和断点续跑的清单保持一致。'''
+    def __init__(self, db_path, mode="flag", threshold=0.85, num_perm=128, shingle_size=5, commit_every=1000, max_candidates=32):
+        assert mode in ("drop", "flag"), f"unknown near dup mode {mode}"
+        self.db_path = str(db_path)
+        self.mode = mode
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.commit_every = commit_every
+        self.max_candidates = max_candidates
+        self._pending = list()          # 还没有写入数据库的 (repo_name, path, sig, 各段的key)
+        self._pending_bands = dict()    # (band, key) -> self._pending中的下标
+        self._conn = sqlite3.connect(self.db_path, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS docs (id INTEGER PRIMARY KEY, repo_name TEXT, path TEXT, sig BLOB)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS bands (band INTEGER, key BLOB, doc INTEGER, PRIMARY KEY (band, key, doc)) WITHOUT ROWID")
+        # 签名参数决定了索引的内容，已有的索引沿用当时的参数
+        for key, value in (("num_perm", num_perm), ("shingle_size", shingle_size)):
+            self._conn.execute("INSERT OR IGNORE INTO meta VALUES (?, ?)", (key, str(value)))
+            saved = int(self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()[0])
+            assert saved == value, f"{self.db_path} was built with {key}={saved}"
+        self._conn.commit()
+        self.minhasher = MinHasher(num_perm)
+        self.bands, self.rows = self._choose_bands(num_perm, threshold)
+
+    @staticmethod
+    def _choose_bands(num_perm, threshold):
+        '''在band数*行数=num_perm的组合中，选S曲线拐点(1/b)^(1/r)不超过threshold的最大者，宁可多召回候选再用签名过滤'''
+        best = (num_perm, 1)
+        for b in range(1, num_perm + 1):
+            if num_perm % b: continue
+            r = num_perm // b
+            point = (1 / b) ** (1 / r)
+            if point <= threshold and point > (1 / best[0]) ** (1 / best[1]): best = (b, r)
+        return best
+
+    def signer(self):
+        '''返回 text -> 签名 的函数，可以传给进程池，在主进程之外计算签名'''
+        return partial(text_signature, minhasher=self.minhasher, shingle_size=self.shingle_size)
+
+    def lookup_or_add(self, text, repo_name, path, sig=None):
+        '''文件太短（不足一个shingle）时返回None；
+        找到近似重复的文件时返回它的(repo_name, path, 相似度)，否则把当前文件加入索引并返回None。
+        sig为已经算好的签名（见signer），为None时在这里计算'''
+        if sig is None: sig = text_signature(text, self.minhasher, self.shingle_size)
+        if not sig: return None
+        width = self.rows * 4
+        keys = [sig[i * width:(i + 1) * width] for i in range(self.bands)]
+        candidates, pending = set(), set()
+        for band, key in enumerate(keys):
+            rows = self._conn.execute("SELECT doc FROM bands WHERE band = ? AND key = ? LIMIT ?", (band, key, self.max_candidates))
+            candidates.update(doc for doc, in rows)
+            pending.update(self._pending_bands.get((band, key), ())[:self.max_candidates])
+        others = [self._conn.execute("SELECT repo_name, path, sig FROM docs WHERE id = ?", (doc,)).fetchone() for doc in candidates]
+        others.extend(self._pending[i][:3] for i in sorted(pending))
+        best = None
+        for other_repo, other_path, other_sig in others:
+            similarity = jaccard(sig, other_sig)
+            if similarity >= self.threshold and (best is None or similarity > best[2]):
+                best = (other_repo, other_path, similarity)
+        if best is not None: return best
+        for band, key in enumerate(keys):
+            self._pending_bands.setdefault((band, key), list()).append(len(self._pending))
+        self._pending.append((repo_name, path, sig, keys))
+        if self.commit_every is not None and len(self._pending) >= self.commit_every: self.commit()
+        return None
+
+    def dedup(self, dic, repo_key="repo_name", ref_key="near_dup_of", sig=None):
+        '''返回需要写入的记录，近似重复且mode为"drop"时返回None。text为空的记录（比如md5去重只保留引用的）直接返回'''
+        if not dic["text"]: return dic
+        t = time.perf_counter()
+        similar = self.lookup_or_add(dic["text"], dic[repo_key], dic["path"], sig)
+        stats.lap("near_dup", t)
+        if similar is None: return dic
+        if self.mode == "drop":
+            stats.count("dropped.near_duplicate")
+            return None
+        stats.count("near_duplicate.flagged")
+        dic[ref_key] = f"{similar[0]}/{similar[1]}"
+        return dic
+
+    def commit(self):
+        for repo_name, path, sig, keys in self._pending:
+            doc = self._conn.execute("INSERT INTO docs (repo_name, path, sig) VALUES (?, ?, ?)", (repo_name, path, sig)).lastrowid
+            self._conn.executemany("INSERT OR IGNORE INTO bands VALUES (?, ?, ?)", ((band, key, doc) for band, key in enumerate(keys)))
+        self._conn.commit()
+        self._pending = list()
+        self._pending_bands = dict()
+
+    def rollback(self):
+        '''丢弃上次commit()之后加入的文件，用于一个输入处理失败时'''
+        self._pending = list()
+        self._pending_bands = dict()
+
+    def close(self):
+        self.commit()
+        self._conn.close()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+import os
+import json
+import time
+import queue
+import tempfile
+import threading
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from stats import stats
+
+
+def ordered_map(fn, iterable, workers, max_pending=None, initializer=None, initargs=()):
+    '''用进程池并行执行fn，结果按输入顺序依次返回，保证多进程下输出的jsonl内容和顺序不变。
+    max_pending限制同时在途的任务数，避免结果在主进程里堆积占用内存。
+    initializer在每个工作进程启动时调用一次，用来建立进程内各个任务共用的状态（比如缓存）。'''
+    if max_pending is None: max_pending = workers * 2
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        pending = deque()
+        for item in iterable:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class RecordBuffer:
+    '''进程池中收集一个仓库的记录，返回给主进程写入。
+    缓存的text超过max_chars个字符后，之后的记录都转存到临时jsonl文件中，主进程迭代读取后删除，
+    这样大仓库在进程间传递时的内存占用只跟max_chars有关。临时文件为 <tmp_dir>/<prefix>xxxx.jsonl.tmp。'''
+    def __init__(self, max_chars, tmp_dir=None, prefix="tmp"):
+        self.max_chars = max_chars
+        self.tmp_dir = tmp_dir
+        self.prefix = prefix
+        self.records = list()
+        self.chars = 0
+        self.spill_path = None
+        self._spill = None
+
+    def append(self, dic):
+        if self._spill is not None:
+            self._spill.write(json.dumps(dic, ensure_ascii=False) + "\n")
+            return
+        self.records.append(dic)
+        self.chars += len(dic.get("text") or "")
+        if self.chars > self.max_chars:
+            fd, self.spill_path = tempfile.mkstemp(suffix=".jsonl.tmp", prefix=self.prefix, dir=self.tmp_dir)
+            self._spill = open(fd, "w", encoding="utf-8")
+            for r in self.records:
+                self._spill.write(json.dumps(r, ensure_ascii=False) + "\n")
+            self.records = list()
+
+    def close(self):
+        '''返回给主进程之前调用'''
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    def discard(self):
+        '''不再需要其中的记录时（比如仓库处理出错）删除临时文件'''
+        self.close()
+        self.records = list()
+        if self.spill_path is not None:
+            os.unlink(self.spill_path)
+            self.spill_path = None
+
+    def __iter__(self):
+        yield from self.records
+        if self.spill_path is not None:
+            with open(self.spill_path, "r", encoding="utf-8") as r:
+                for line in r:
+                    yield json.loads(line)
+            os.unlink(self.spill_path)
+
+
+def prefetch(paths, depth=2, max_bytes=1024 * 1024 * 1024):
+    '''后台线程按顺序把接下来的depth个文件读进内存，yield (path, 文件内容)，让网络存储的读取和当前文件的处理重叠。
+    已读入、还没处理完的内容总大小不超过max_bytes；超过max_bytes的单个文件和读取失败的文件不预读，
+    yield (path, None)，由调用方自己读取。depth为0时不预读。'''
+    if depth <= 0:
+        for path in paths: yield path, None
+        return
+    items = queue.Queue(maxsize=depth)
+    cond = threading.Condition()
+    state = {"used": 0, "stop": False}
+
+    def reader():
+        for path in paths:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = None
+            data = None
+            if size is not None and size <= max_bytes:
+                with cond:
+                    cond.wait_for(lambda: state["used"] + size <= max_bytes or state["stop"])
+                    if state["stop"]: return
+                    state["used"] += size
+                try:
+                    with open(path, "rb") as r: data = r.read()
+                except OSError:
+                    data = None
+                if data is None or len(data) != size:
+                    with cond:
+                        state["used"] -= size
+                        cond.notify_all()
+                    data = None
+            items.put((path, data))
+            if state["stop"]: return
+        items.put(None)
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            t = time.perf_counter()
+            item = items.get()
+            stats.lap("prefetch_wait", t)
+            if item is None: break
+            path, data = item
+            stats.count("prefetch.hit" if data is not None else "prefetch.miss")
+            yield path, data
+            if data is not None:
+                with cond:
+                    state["used"] -= len(data)
+                    cond.notify_all()
+            del item, data
+    finally:
+        with cond:
+            state["stop"] = True
+            cond.notify_all()
+        # 清空队列，让阻塞在put上的读取线程退出
+        while thread.is_alive():
+            try:
+                items.get(timeout=0.1)
+            except queue.Empty:
+                pass
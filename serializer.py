@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def _stdlib_dumps_str(s):
+    return json.dumps(s, ensure_ascii=False).encode("utf-8")
+
+
+def _select_dumps_str():
+    '''选择字符串的序列化实现，优先orjson，其次ujson。
+    输出必须与json.dumps(ensure_ascii=False)逐字节一致，导入时用包含所有控制字符的字符串检查一次，不一致就不用'''
+    candidates = list()
+    if orjson is not None: candidates.append(orjson.dumps)
+    if ujson is not None: candidates.append(lambda s: ujson.dumps(s, ensure_ascii=False, escape_forward_slashes=False).encode("utf-8"))
+    probe = "".join(chr(i) for i in range(0x80)) + "  中文\U0001f600﻿"
+    for fn in candidates:
+        try:
+            if fn(probe) == _stdlib_dumps_str(probe): return fn
+        except:
+            pass
+    return _stdlib_dumps_str
+
+
+_dumps_str = _select_dumps_str()
+
+
+def dumps_value(value):
+    '''序列化一个值为utf-8编码的bytes，与json.dumps(value, ensure_ascii=False)一致'''
+    if type(value) is str:
+        try:
+            return _dumps_str(value)
+        except TypeError:
+            # 比如包含单独的代理字符，orjson不支持，交给标准库处理
+            pass
+    return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+
+class RecordEncoder:
+    '''把一条记录序列化为一行jsonl的bytes，输出与 json.dumps(dic, ensure_ascii=False) + "\\n" 逐字节一致。
+    键名只编码一次；constant_keys中的字段（平台、仓库名等）在同一个仓库内不变，
+    值变化时才重新编码，其余字段（主要是text）用orjson等更快的实现逐个编码后直接拼接。'''
+    _missing = object()
+
+    def __init__(self, constant_keys=()):
+        self._keys = dict()
+        self._constants = {k: (self._missing, None) for k in constant_keys}
+
+    def encode(self, dic):
+        parts = list()
+        for k, v in dic.items():
+            key = self._keys.get(k)
+            if key is None:
+                key = self._keys[k] = dumps_value(k) + b": "
+            if k in self._constants and type(v) is str:
+                last, encoded = self._constants[k]
+                if v is not last and v != last:
+                    encoded = dumps_value(v)
+                    self._constants[k] = (v, encoded)
+            else:
+                encoded = dumps_value(v)
+            parts.append(key + encoded)
+        return b"{" + b", ".join(parts) + b"}\n"
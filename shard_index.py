@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+'''jsonl分片的索引：每个分片旁边一个 <分片>.idx（SQLite），记录每条记录的md5、仓库名、path和位置，
+按md5或 仓库名/path 查找时直接定位到记录，不需要顺序扫描或解压整个分片。
+
+    python shard_index.py ./out --md5 0123456789abcdef0123456789abcdef
+    python shard_index.py ./out --repo esbatmop/MNBVC --path main/README.md
+'''
+import json
+import gzip
+import sqlite3
+import argparse
+
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+INDEX_SUFFIX = ".idx"
+
+
+def index_path(shard_path):
+    return Path(str(shard_path) + INDEX_SUFFIX)
+
+
+class ShardIndex:
+    '''一个分片的索引。位置为 (block, offset, length)：不压缩时block是记录在文件中的字节偏移，offset为0；
+    压缩时block是记录所在的zstd frame/gzip member在文件中的起始位置，offset是记录在解压后的frame中的偏移，
+    每个仓库写完时都会结束当前的frame，查找时最多只需要解压一个仓库的内容。add之后只在调用commit()时提交。'''
+    def __init__(self, path):
+        self.path = Path(path)
+        self._conn = sqlite3.connect(str(self.path))
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS records (md5 TEXT, repo TEXT, path TEXT, block INTEGER, offset INTEGER, length INTEGER)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS records_md5 ON records (md5)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS records_repo_path ON records (repo, path)")
+        self._conn.commit()
+        self._pending = list()
+
+    def add(self, md5, repo, path, block, offset, length):
+        self._pending.append((md5, repo, path, block, offset, length))
+
+    def commit(self):
+        self._conn.executemany("INSERT INTO records VALUES (?, ?, ?, ?, ?, ?)", self._pending)
+        self._conn.commit()
+        self._pending = list()
+
+    def truncate(self, size):
+        '''分片被截断到size字节时，删除之后的记录'''
+        self._pending = list()
+        self._conn.execute("DELETE FROM records WHERE block >= ?", (size,))
+        self._conn.commit()
+
+    def find(self, md5=None, repo=None, path=None, limit=None):
+        '''返回匹配的 (block, offset, length) 列表'''
+        conditions, params = list(), list()
+        for column, value in (("md5", md5), ("repo", repo), ("path", path)):
+            if value is None: continue
+            conditions.append(f"{column} = ?")
+            params.append(value)
+        assert conditions, "md5, repo or path is required"
+        sql = "SELECT block, offset, length FROM records WHERE " + " AND ".join(conditions) + " ORDER BY block, offset"
+        if limit is not None: sql += f" LIMIT {int(limit)}"
+        return self._conn.execute(sql, params).fetchall()
+
+    def close(self):
+        self.commit()
+        self._conn.close()
+
+
+def read_record(shard_path, block, offset, length):
+    '''从分片中读出一条记录，按后缀判断压缩格式'''
+    shard_path = str(shard_path)
+    with open(shard_path, "rb") as f:
+        f.seek(block)
+        if shard_path.endswith(".zst"):
+            reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+        elif shard_path.endswith(".gz"):
+            reader = gzip.GzipFile(fileobj=f, mode="rb")
+        else:
+            reader = f
+        # 压缩时跳过frame中这条记录之前的内容
+        while offset > 0:
+            skipped = len(reader.read(min(offset, 1024 * 1024)))
+            if not skipped: raise EOFError(f"{shard_path} is truncated")
+            offset -= skipped
+        data = reader.read(length)
+    return json.loads(data)
+
+
+def shards(output):
+    '''output为分片或者分片所在的目录，返回有索引的分片'''
+    output = Path(output)
+    if output.is_file(): return [output]
+    return sorted(Path(str(p)[:-len(INDEX_SUFFIX)]) for p in output.glob(f"*{INDEX_SUFFIX}"))
+
+
+def lookup(output, md5=None, repo=None, path=None, limit=None):
+    '''在output（分片或分片所在的目录）的索引中查找，逐个yield (分片, 记录)'''
+    for shard in shards(output):
+        index = ShardIndex(index_path(shard))
+        try:
+            locations = index.find(md5, repo, path, limit)
+        finally:
+            index.close()
+        for location in locations:
+            yield shard, read_record(shard, *location)
+            if limit is not None:
+                limit -= 1
+                if limit <= 0: return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("output", type=str, help="分片或者分片所在的目录")
+    parser.add_argument("--md5", type=str, default=None, help="按文件内容的md5查找")
+    parser.add_argument("--repo", type=str, default=None, help="按仓库名查找")
+    parser.add_argument("--path", type=str, default=None, help="按文件在仓库中的path查找，可以和--repo一起使用")
+    parser.add_argument("--limit", type=int, default=None, help="最多输出的记录数")
+    parser.add_argument("--meta", action="store_true", default=False, help="只输出分片名和除text之外的字段")
+    args = parser.parse_args()
+    for shard, record in lookup(args.output, args.md5, args.repo, args.path, args.limit):
+        if args.meta:
+            record.pop("text", None)
+            record["shard"] = shard.name
+        print(json.dumps(record, ensure_ascii=False))
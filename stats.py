@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+import os
+import json
+import time
+import logging
+
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+class Stats:
+    '''转换流程的统计：各阶段耗时（times）和各种计数（counters）。
+    阶段：unzip/read/hash/detect/decode/serialize/write；
+    计数：files.seen、files.kept、dropped.<原因>、decode.<方式>、bytes.in、bytes.out 等。
+    进程池中的worker每个任务开始时reset()，结束时把snapshot()随结果返回，由主进程merge()。'''
+    def __init__(self, report_interval=60):
+        self.times = Counter()
+        self.counters = Counter()
+        self.report_interval = report_interval
+        self.start_time = time.perf_counter()
+        self._last_report = self.start_time
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def lap(self, stage, start):
+        '''把start到现在的时间记到stage上，返回现在的时间，方便连续计时'''
+        now = time.perf_counter()
+        self.times[stage] += now - start
+        return now
+
+    def snapshot(self):
+        return {"times": dict(self.times), "counters": dict(self.counters)}
+
+    def reset(self):
+        self.times.clear()
+        self.counters.clear()
+
+    def merge(self, snapshot):
+        self.times.update(snapshot["times"])
+        self.counters.update(snapshot["counters"])
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.start_time
+        times = ", ".join(f"{k} {v:.1f}s" for k, v in sorted(self.times.items()))
+        counters = ", ".join(f"{k} {v}" for k, v in sorted(self.counters.items()))
+        return f"运行 {elapsed:.0f} 秒；阶段耗时: {times}；计数: {counters}"
+
+    def maybe_report(self):
+        '''距离上次输出超过report_interval秒时输出一次汇总'''
+        now = time.perf_counter()
+        if now - self._last_report < self.report_interval: return
+        self._last_report = now
+        logger.info(self.summary())
+
+    def export(self, path):
+        '''保存统计结果，后缀为.prom时输出Prometheus textfile格式，否则输出json'''
+        path = str(path)
+        if path.endswith(".prom"):
+            lines = ["# TYPE githubcode_stage_seconds_total counter"]
+            lines += [f'githubcode_stage_seconds_total{{stage="{k}"}} {v}' for k, v in sorted(self.times.items())]
+            lines += ["# TYPE githubcode_events_total counter"]
+            lines += [f'githubcode_events_total{{name="{k}"}} {v}' for k, v in sorted(self.counters.items())]
+            lines += ["# TYPE githubcode_elapsed_seconds gauge", f"githubcode_elapsed_seconds {time.perf_counter() - self.start_time}"]
+            content = "\n".join(lines) + "\n"
+        else:
+            data = self.snapshot()
+            data["elapsed"] = time.perf_counter() - self.start_time
+            content = json.dumps(data, ensure_ascii=False, indent=2)
+        # 先写临时文件再替换，避免采集端读到写了一半的文件
+        with open(path + ".tmp", "w", encoding="utf-8") as w:
+            w.write(content)
+        os.replace(path + ".tmp", path)
+
+
+# 每个进程一份
+stats = Stats()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+'''断点续跑的回归测试：中途崩溃后按清单续跑，输出的分片要和不中断时完全相同。
+
+    python -m unittest test_resume
+'''
+import os
+import sys
+import random
+import subprocess
+import tempfile
+import unittest
+
+from pathlib import Path
+from checkpoint import CheckpointManifest
+from jsonl_writer import ShardedJsonlWriter, zstandard
+from columnar_writer import ShardedColumnarWriter, pa
+
+REPO_SIZE = 10
+N_RECORDS = 1500
+MAX_SIZE = 100 * 1024
+COLUMNS = [("repo_name", "str"), ("path", "str"), ("md5", "str"), ("text", "str")]
+
+
+def make_records():
+    rnd = random.Random(0)
+    words = ["def", "return", "if", "else", "value", "self", "print", "x", "=", "+", "(", ")", ":"]
+    return [{"repo_name": f"repo{i // REPO_SIZE}", "path": f"src/file{i}.py", "md5": f"{i:032x}",
+             "text": " ".join(rnd.choice(words) for _ in range(rnd.randint(10, 60)))} for i in range(N_RECORDS)]
+
+
+def crash(writer):
+    '''把缓冲区中写了一半的内容刷到磁盘后直接退出进程'''
+    if isinstance(writer, ShardedColumnarWriter):
+        writer._flush_batch()
+        writer._fp.flush()
+    else:
+        writer._raw.flush()
+    os._exit(1)
+
+
+def convert(output, compression, crash_at=None, resume=False, fmt=None):
+    '''每REPO_SIZE条记录作为一个输入，写完后sync并记录到清单。写到第crash_at条时模拟崩溃。
+    fmt为"parquet"或"arrow"时用ShardedColumnarWriter'''
+    records = make_records()
+    if fmt is None:
+        writer = ShardedJsonlWriter(output, "test", MAX_SIZE, compression=compression)
+    else:
+        writer = ShardedColumnarWriter(output, "test", COLUMNS, fmt=fmt, max_size=MAX_SIZE, batch_rows=4)
+    manifest_path = Path(output) / "test.checkpoint"
+    resume_from_manifest = resume and manifest_path.exists()
+    manifest = CheckpointManifest(manifest_path, resume=resume)
+    if not resume_from_manifest: manifest.mark_start(*writer.sync())
+    elif manifest.position is not None: writer.resume(*manifest.position)
+    st = os.stat(output)
+    for start in range(0, len(records), REPO_SIZE):
+        repo = f"repo{start // REPO_SIZE}"
+        if repo in manifest.done: continue
+        for i in range(start, start + REPO_SIZE):
+            if i == crash_at: crash(writer)
+            writer.write(records[i])
+        manifest.mark_done(repo, st, *writer.sync())
+    writer.close()
+    manifest.close()
+
+
+class ResumeTest(unittest.TestCase):
+    @staticmethod
+    def shards(output):
+        return {p.name: p.read_bytes() for p in sorted(Path(output).glob("test.*")) if p.suffix != ".checkpoint"}
+
+    def check_resume(self, compression):
+        with tempfile.TemporaryDirectory() as tmp:
+            expected, resumed = Path(tmp) / "expected", Path(tmp) / "resumed"
+            os.makedirs(expected)
+            os.makedirs(resumed)
+            convert(expected, compression)
+            code = f"import test_resume; test_resume.convert({str(resumed)!r}, {compression!r}, crash_at=1020)"
+            proc = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)))
+            self.assertEqual(proc.returncode, 1)
+            convert(resumed, compression, resume=True)
+            expected_shards = self.shards(expected)
+            self.assertGreater(len(expected_shards), 2)
+            self.assertEqual(list(expected_shards), list(self.shards(resumed)))
+            for name, data in expected_shards.items():
+                self.assertEqual(data, self.shards(resumed)[name], name)
+
+    def check_earlier_run(self, compression, fmt=None):
+        '''输出目录中已经有之前的分片，不加resume的运行在第一个输入完成之前崩溃，续跑不能删掉之前的分片'''
+        with tempfile.TemporaryDirectory() as tmp:
+            expected, resumed = Path(tmp) / "expected", Path(tmp) / "resumed"
+            for output in (expected, resumed):
+                os.makedirs(output)
+                convert(output, compression, fmt=fmt)
+            earlier = self.shards(resumed)
+            convert(expected, compression, fmt=fmt)
+            code = f"import test_resume; test_resume.convert({str(resumed)!r}, {compression!r}, crash_at=5, fmt={fmt!r})"
+            proc = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)))
+            self.assertEqual(proc.returncode, 1)
+            convert(resumed, compression, resume=True, fmt=fmt)
+            resumed_shards = self.shards(resumed)
+            for name, data in earlier.items():
+                self.assertEqual(data, resumed_shards[name], name)
+            self.assertEqual(self.shards(expected), resumed_shards)
+
+    def test_uncompressed(self):
+        self.check_resume(None)
+
+    def test_gzip(self):
+        self.check_resume("gzip")
+
+    @unittest.skipIf(zstandard is None, "zstandard is not installed")
+    def test_zstd(self):
+        self.check_resume("zstd")
+
+    def test_earlier_run(self):
+        self.check_earlier_run(None)
+
+    def test_earlier_run_gzip(self):
+        self.check_earlier_run("gzip")
+
+    @unittest.skipIf(pa is None, "pyarrow is not installed")
+    def test_earlier_run_parquet(self):
+        self.check_earlier_run(None, "parquet")
+
+
+if __name__ == "__main__":
+    unittest.main()
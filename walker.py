@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+import os
+import fnmatch
+
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+
+def list_dirs(root):
+    '''root下的子目录，按名字排序，和 glob.glob(root + "/*") 一样跳过以'.'开头的目录'''
+    with os.scandir(root) as it:
+        return sorted(Path(entry.path) for entry in it if not entry.name.startswith(".") and entry.is_dir())
+
+
+class ScandirWalker:
+    '''用os.scandir遍历目录，文件类型取自目录项本身，大小取自DirEntry.stat()，每个文件只需要一次stat，
+    比 Path.rglob + is_file + exists + stat 少了多次元数据操作，在NFS上差别很明显。
+    线程池提前读取接下来最多max_pending个目录，多个目录的scandir同时进行；返回的顺序和Path.rglob相同
+    （先序深度优先，目录内按scandir的顺序），输出与串行遍历一致。'''
+    def __init__(self, threads=8, max_pending=1024):
+        self.threads = threads
+        self.max_pending = max_pending
+        self._pool = None
+
+    def __getstate__(self):
+        # 线程池不能传给子进程，在子进程中第一次遍历时重新创建
+        state = self.__dict__.copy()
+        state["_pool"] = None
+        return state
+
+    @staticmethod
+    def _scan(path):
+        '''返回 ([(文件名, 路径, 大小)], [子目录])，和rglob一样不进入指向目录的符号链接，忽略没有权限的目录'''
+        files, dirs = list(), list()
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False): dirs.append(entry.path)
+                        elif entry.is_file(): files.append((entry.name, entry.path, entry.stat().st_size))
+                    except OSError:
+                        continue
+        except PermissionError:
+            pass
+        return files, dirs
+
+    def walk(self, root, pattern="**/*"):
+        '''逐个yield root下文件名匹配pattern的文件 (路径, 大小)，pattern为 "**/<文件名通配符>"，和 Path.rglob(pattern) 的结果相同'''
+        assert pattern.startswith("**/") and "/" not in pattern[3:], f"unsupported pattern {pattern}"
+        name_pattern = pattern[3:]
+        if self.threads <= 1:
+            scan = self._scan
+        else:
+            if self._pool is None: self._pool = ThreadPoolExecutor(self.threads)
+            pending = 0
+
+            def scan(path):
+                # 已经提交的目录取结果，否则在当前线程中读取
+                nonlocal pending
+                if isinstance(path, str): return self._scan(path)
+                pending -= 1
+                return path.result()
+
+            def submit(path):
+                nonlocal pending
+                if pending >= self.max_pending: return path
+                pending += 1
+                return self._pool.submit(self._scan, path)
+        stack = [iter([str(root)])]
+        while stack:
+            path = next(stack[-1], None)
+            if path is None:
+                stack.pop()
+                continue
+            files, dirs = scan(path)
+            # 先提交子目录，处理当前目录的文件时线程池已经在读取它们
+            if self.threads > 1: dirs = [submit(d) for d in dirs]
+            for name, file_path, size in files:
+                if fnmatch.fnmatchcase(name, name_pattern): yield Path(file_path), size
+            stack.append(iter(dirs))